@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+""" smdv benchmarks: microbenchmarks for the rendering and messaging hot paths
+
+Usage:
+    python3 benchmark.py                    # run and compare against the baseline
+    python3 benchmark.py --update-baseline  # run and store the results as baseline
+    python3 benchmark.py --output out.json  # also write the results to a file
+    python3 benchmark.py --markdown-backend markdown-it  # benchmark another backend
+    python3 benchmark.py --conformance markdown-it  # compare its html to python-markdown
+
+--conformance also checks that a graceful shutdown of the server lets the
+renders of in-flight requests complete (see drain).
+
+All documents are generated synthetically (and deterministically), such that
+the benchmarks can be run offline. The exit status is 1 when one of the
+benchmarks regressed with respect to the stored baseline.
+"""
+
+## Imports
+
+# python standard library
+import os
+import sys
+import json
+import time
+import random
+import difflib
+import argparse
+import platform
+import tempfile
+import statistics
+import html.parser
+
+# smdv
+import smdv
+
+## Globals
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud "
+    "exercitation ullamco laboris nisi aliquip ex ea commodo consequat"
+).split()
+
+
+## Corpus generators (alphabetic)
+
+# generate a code-heavy markdown document
+def code_corpus(size: int, rng: random.Random) -> str:
+    """ generate a markdown document consisting mostly of fenced code blocks """
+    blocks = []
+    while sum(map(len, blocks)) < size:
+        lines = [
+            f"    {rng.choice(WORDS)}_{i} = {rng.choice(WORDS)}({rng.randint(0, 99)}, '{rng.choice(WORDS)}')"
+            for i in range(rng.randint(5, 30))
+        ]
+        code = "\n".join([f"def {rng.choice(WORDS)}():"] + lines + ["    return None"])
+        blocks.append(f"{sentence(rng)}\n\n```python\n{code}\n```\n")
+    return "\n".join(blocks)
+
+
+# generate a markdown document referring to a few footnotes many times
+def footnotes_corpus(size: int, rng: random.Random) -> str:
+    """ generate a markdown document with a table of contents and repeated footnotes """
+    paragraphs = ["[TOC]"]
+    while sum(map(len, paragraphs)) < size:
+        if len(paragraphs) % 10 == 1:
+            paragraphs.append(f"## {sentence(rng, 1)}")  # (repeated titles get unique ids)
+        paragraph = " ".join(
+            f"{sentence(rng)}[^n{rng.randrange(7)}]" for _ in range(rng.randint(2, 8))
+        )
+        paragraphs.append(paragraph)
+    paragraphs += [f"[^n{i}]: {sentence(rng)}\n\n    {sentence(rng)}" for i in range(7)]
+    return "\n\n".join(paragraphs)
+
+
+# generate a directory with many files
+def directory_corpus(path: str, size: int, rng: random.Random):
+    """ populate a directory with `size` files and `size//10` subdirectories """
+    for i in range(size // 10):
+        os.makedirs(os.path.join(path, f"{rng.choice(WORDS)}_dir_{i}"), exist_ok=True)
+    for i in range(size):
+        ext = rng.choice([".md", ".txt", ".ipynb", ".py", ".png"])
+        with open(os.path.join(path, f"{rng.choice(WORDS)}_{i}{ext}"), "w") as file:
+            file.write(sentence(rng))
+
+
+# generate a link-heavy markdown document
+def links_corpus(size: int, rng: random.Random) -> str:
+    """ generate a markdown document containing many (relative) links and images """
+    lines = []
+    while sum(map(len, lines)) < size:
+        word = rng.choice(WORDS)
+        lines.append(
+            rng.choice(
+                [
+                    f"- [{word}]({word}/{rng.randint(0, 999)}.md)",
+                    f"- ![{word}](img/{word}_{rng.randint(0, 999)}.png)",
+                    f"- [{word}](https://example.com/{word}/{rng.randint(0, 999)})",
+                    f"- [{word}](#{word}-{rng.randint(0, 999)})",
+                ]
+            )
+        )
+    return "\n".join(lines)
+
+
+# generate a math-heavy markdown document
+def math_corpus(size: int, rng: random.Random) -> str:
+    """ generate a markdown document containing many inline and display equations """
+    paragraphs = []
+    while sum(map(len, paragraphs)) < size:
+        a, b = rng.choice(WORDS)[0], rng.choice(WORDS)[0]
+        paragraphs.append(
+            f"{sentence(rng)} $\\frac{{{a}^2}}{{{b}_i}}$ {sentence(rng)}\n\n"
+            f"$$\n\\sum_{{i=0}}^{{{rng.randint(1, 99)}}} {a}_i {b}^i = \\int_0^1 f({a}) d{a}\n$$\n"
+        )
+    return "\n".join(paragraphs)
+
+
+# generate a prose-heavy markdown document
+def prose_corpus(size: int, rng: random.Random) -> str:
+    """ generate a markdown document consisting mostly of prose """
+    paragraphs = []
+    while sum(map(len, paragraphs)) < size:
+        if len(paragraphs) % 10 == 0:
+            paragraphs.append(f"## {sentence(rng, 3)}")
+        paragraph = " ".join(sentence(rng) for _ in range(rng.randint(2, 8)))
+        paragraphs.append(paragraph.replace(" et ", " *et* ").replace(" ut ", " **ut** "))
+    return "\n\n".join(paragraphs)
+
+
+# generate a random sentence
+def sentence(rng: random.Random, num_words: int = 0) -> str:
+    """ generate a random sentence """
+    words = [rng.choice(WORDS) for _ in range(num_words or rng.randint(5, 15))]
+    return " ".join(words).capitalize() + "."
+
+
+# generate a markdown document containing a huge table
+def table_corpus(size: int, rng: random.Random) -> str:
+    """ generate a markdown document consisting of a single huge table """
+    rows = ["| id | name | value | description |", "|---:|:-----|------:|:------------|"]
+    while sum(map(len, rows)) < size:
+        rows.append(
+            f"| {len(rows)} | {rng.choice(WORDS)} | {rng.random():.4f} | {sentence(rng, 4)} |"
+        )
+    return "\n".join(rows)
+
+
+CORPORA = {
+    "prose": prose_corpus,
+    "code": code_corpus,
+    "math": math_corpus,
+    "links": links_corpus,
+    "table": table_corpus,
+}
+
+FIXTURES = {  # name: markdown using a feature smdv relies on (see conformance)
+    "emphasis": "Some *emphasis*, **strong** text, `code` and a [link](other.md).\n",
+    "lists": "- one\n- two\n    - nested\n\n1. first\n2. second\n",
+    "html": '<div class="note">\n<b>raw</b> html\n</div>\n\nafter the html\n',
+    "math": "Inline $x^2$ math and\n\n$$\n\\sum_i a_i\n$$\n",
+    "admonition": '!!! note "Title"\n    The *body*.\n\n!!! warning\n    Careful.\n',
+    "toc": "# One\n\n[TOC]\n\n## Two `code`\n\n### Three *em*\n\n## Four\n",
+    "fenced_code": "```python\ndef f(x):\n    return x  # comment\n```\n\n```\nplain\n```\n",
+    "tables": "| a | b |\n|:--|--:|\n| 1 | *2* |\n| 3 | 4 |\n",
+    "def_list": "Term\n: the definition\n",
+    "footnotes": "Text with a note[^1].\n\n[^1]: The note.\n",
+}
+PARALLEL = "parallel-footnotes"  # the document rendered serially and in parallel (see conformance)
+
+
+## Conformance
+
+
+class HTMLTokens(html.parser.HTMLParser):
+    """ tokenize html, ignoring whitespace between tags and the order of attributes """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tokens = []
+
+    def handle_starttag(self, tag, attrs):
+        self.tokens.append(f"<{tag} {sorted(attrs)}>")
+
+    def handle_endtag(self, tag):
+        self.tokens.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        self.tokens.extend(data.split())
+
+
+# compare the html of a markdown backend to the html of python-markdown
+def conformance(backend: str) -> dict:
+    """ render the fixtures and corpora with a backend and with python-markdown
+
+    The "parallel" document is rendered with the backend only, serially and
+    in parallel (see PARALLEL_MIN_SIZE), which should result in the same html.
+
+    Args:
+        backend: the markdown backend to compare (see --markdown-backend)
+
+    Returns:
+        similarity: dict: the similarity (between 0 and 1) of the html tokens
+            per document
+    """
+    documents = dict(FIXTURES)
+    for kind, corpus in CORPORA.items():
+        documents[f"{kind}-10k"] = corpus(SIZES["10k"], random.Random(0))
+    options = {name: [["--markdown-backend", "python-markdown"], ["--markdown-backend", backend]]
+               for name in documents}
+    documents[PARALLEL] = footnotes_corpus(smdv.PARALLEL_MIN_SIZE * 11 // 10, random.Random(0))
+    options[PARALLEL] = [["--markdown-backend", backend, "--render-workers", workers]
+                         for workers in ("1", "4")]
+    similarity = {}
+    for name, document in documents.items():
+        tokens = []
+        for args in options[name]:  # (rendered in the benchmark process, see --render-timeout)
+            smdv.ARGS = smdv.parse_args(args + ["--render-timeout", "0"])
+            parser = HTMLTokens()
+            parser.feed(smdv.md2body(document, static_url=""))
+            tokens.append(parser.tokens)
+            if smdv.RENDER_POOL is not None:
+                smdv.RENDER_POOL.shutdown()
+                smdv.RENDER_POOL = None
+        similarity[name] = 1.0 if tokens[0] == tokens[1] else (
+            difflib.SequenceMatcher(None, *tokens, autojunk=False).ratio()
+        )
+    return similarity
+
+
+# check that a graceful shutdown lets in-flight renders complete
+def drain() -> bool:
+    """ start a render, shut down the (not listening) server and wait for the render
+
+    The render reaches the render thread only after the shutdown started, like
+    a request that is still being handled while the server drains.
+
+    Returns:
+        completed: bool: whether the render completed (with html)
+    """
+    import asyncio
+
+    with tempfile.TemporaryDirectory() as home:
+        smdv.ARGS = smdv.parse_args(["--home", home, "--render-timeout", "0"])
+        loop = smdv.event_loop()
+
+        async def request():
+            await asyncio.sleep(0.1)  # (while shutdown waits for the in-flight requests)
+            return await smdv.run_render(smdv.md2body, prose_corpus(SIZES["10k"], random.Random(0)))
+
+        loop.run_until_complete(smdv.run_render(smdv.md2body, "# a previous render"))
+        task = smdv.track(request())
+        loop.call_soon(lambda: asyncio.ensure_future(smdv.shutdown(timeout=10.0)))
+        loop.run_forever()
+        smdv.RENDER_THREAD = smdv.RENDER_POOL = None
+        return task.done() and not task.cancelled() and task.exception() is None and (
+            task.result().startswith("<")
+        )
+
+
+## Benchmark functions (alphabetic)
+
+# compare results to a baseline
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float = 1e-3) -> list:
+    """ compare benchmark results against a baseline
+
+    Args:
+        results: the benchmark results
+        baseline: the baseline results
+        tolerance: the allowed relative slowdown of the median before a
+            benchmark is considered a regression.
+        min_delta: the allowed absolute slowdown of the median (in seconds),
+            such that timer noise on very fast benchmarks is not reported.
+
+    Returns:
+        regressions: list: the names of the benchmarks that regressed
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            print(f"{name:<32} {result['median']*1e3:10.3f} ms   (new)")
+            continue
+        ratio = result["median"] / reference["median"]
+        delta = result["median"] - reference["median"]
+        regressed = ratio > 1 + tolerance and delta > min_delta
+        print(
+            f"{name:<32} {result['median']*1e3:10.3f} ms   "
+            f"{ratio:6.2f}x{'   REGRESSION' if regressed else ''}"
+        )
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+# time a function
+def measure(func, repeat: int) -> dict:
+    """ time a function call multiple times
+
+    Args:
+        func: the function to time (takes no arguments)
+        repeat: the number of times to call the function
+
+    Returns:
+        result: dict: the minimum and median duration (in seconds)
+    """
+    func()  # warm up
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return {"min": min(durations), "median": statistics.median(durations)}
+
+
+# run all benchmarks
+def run(sizes: list, repeat: int, seed: int, backend: str = "python-markdown") -> dict:
+    """ run all benchmarks
+
+    Args:
+        sizes: the document sizes to benchmark (keys of SIZES)
+        repeat: the number of repetitions per benchmark
+        seed: the random seed for the corpus generation
+        backend: the markdown backend to benchmark (see --markdown-backend)
+
+    Returns:
+        results: dict: the result per benchmark
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as home:
+        # disable the render caches to benchmark actual renders:
+        smdv.ARGS = smdv.parse_args(
+            ["--home", home, "--render-cache-size", "0", "--disk-cache-size", "0",
+             "--markdown-backend", backend, "--render-workers", "1", "--render-timeout", "0"]
+        )
+        os.chdir(home)
+
+        for size in sizes:
+            documents = {k: f(SIZES[size], random.Random(seed)) for k, f in CORPORA.items()}
+            for kind, document in documents.items():
+                results[f"md2body[{kind}-{size}]"] = measure(
+                    lambda: smdv.md2body(document), repeat
+                )
+            smdv.ARGS.render_timeout = 20.0  # rendering in the render pool (see --render-timeout)
+            results[f"md2body[prose-{size}-isolated]"] = measure(
+                lambda: smdv.md2body(documents["prose"]), repeat
+            )
+            smdv.ARGS.render_timeout = 0
+            if smdv.RENDER_POOL is not None:  # (not for markdown below ISOLATED_MIN_SIZE)
+                smdv.RENDER_POOL.shutdown()
+                smdv.RENDER_POOL = None
+            if smdv.PARALLEL_MIN_SIZE < len(documents["prose"]):  # parallel rendering
+                for workers in (2, 4):
+                    smdv.ARGS.render_workers = workers
+                    results[f"md2body[prose-{size}-workers{workers}]"] = measure(
+                        lambda: smdv.md2body(documents["prose"]), repeat
+                    )
+                    smdv.RENDER_POOL.shutdown()
+                    smdv.RENDER_POOL = None
+                smdv.ARGS.render_workers = 1
+            results[f"txt2body[code-{size}]"] = measure(
+                lambda: smdv.txt2body(documents["code"]), repeat
+            )
+            results[f"encode[md-{size}]"] = measure(
+                lambda: smdv.encode(
+                    {"filename": "bench.md", "fileBody": documents["prose"]}
+                ),
+                repeat,
+            )
+            message = smdv.encode({"filename": "bench.md", "fileBody": documents["prose"]})
+            message.update(cwd="/", cwdBody="", filename="bench.md", fileOpen=True)
+            results[f"json.dumps[message-{size}]"] = measure(
+                lambda: json.dumps(message), repeat
+            )
+
+        for num_files in (100, 10_000):
+            directory = os.path.join(home, f"dir{num_files}")
+            os.makedirs(directory)
+            directory_corpus(directory, num_files, random.Random(seed))
+            results[f"dir2body[{num_files}]"] = measure(
+                lambda: smdv.dir2body(f"/dir{num_files}/"), repeat
+            )
+
+        with open("text.md", "w") as file:
+            file.write(prose_corpus(SIZES["10k"], random.Random(seed)))
+        with open("binary.png", "wb") as file:
+            file.write(bytes(random.Random(seed).randrange(256) for _ in range(4096)))
+        for filename in ("text.md", "binary.png"):  # (sniffing the file, not the cache)
+            results[f"is_binary_file[{filename}]"] = measure(
+                lambda: smdv.FILE_TYPES.clear() or smdv.is_binary_file(filename), 10 * repeat
+            )
+    return results
+
+
+## Main
+
+# main benchmark program
+def main() -> int:
+    """ The main benchmark program
+
+    Returns:
+        exit_status: 0 if no benchmarks regressed, 1 otherwise.
+    """
+    parser = argparse.ArgumentParser(description="smdv microbenchmarks")
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=["1k", "10k", "100k"],
+        choices=list(SIZES),
+        help="document sizes to benchmark",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions per benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the corpus generator")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline results to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.3,
+        help="allowed relative slowdown before a benchmark is considered a regression",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=1.0,
+        help="allowed absolute slowdown (in ms) before a benchmark is considered a regression",
+    )
+    parser.add_argument("--output", default="", help="write the results to this json file")
+    parser.add_argument(
+        "--markdown-backend",
+        default="python-markdown",
+        choices=smdv.MARKDOWN_BACKENDS,
+        help="the markdown backend to benchmark",
+    )
+    parser.add_argument(
+        "--conformance",
+        default="",
+        choices=smdv.MARKDOWN_BACKENDS,
+        help=("instead of benchmarking, compare the html rendered by this backend to "
+              "the html rendered by python-markdown"),
+    )
+    parser.add_argument(
+        "--min-similarity",
+        type=float,
+        default=0.9,
+        help="the minimum similarity of the html of a fixture for --conformance",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="store the results as the new baseline instead of comparing",
+    )
+    args = parser.parse_args()
+
+    if args.conformance:
+        failures = []
+        for name, similarity in conformance(args.conformance).items():
+            failed = name in FIXTURES and similarity < args.min_similarity
+            failed = failed or name == PARALLEL and similarity < 1  # the html should be equal
+            print(f"{name:<32} {similarity:10.3f}{'   MISMATCH' if failed else ''}")
+            if failed:
+                failures.append(name)
+        completed = drain()
+        print(f"{'shutdown-drain':<32} {'ok' if completed else 'FAILED':>10}")
+        if not completed:
+            failures.append("shutdown-drain")
+        if failures:
+            print(f"\n{len(failures)} fixture(s) differ: {', '.join(failures)}", file=sys.stderr)
+            return 1
+        return 0
+
+    results = {
+        "python": platform.python_version(),
+        "smdv": smdv.__version__,
+        "markdown_backend": args.markdown_backend,
+        "results": run(args.sizes, args.repeat, args.seed, args.markdown_backend),
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline, "r") as file:
+        baseline = json.load(file)["results"]
+    regressions = compare(results["results"], baseline, args.tolerance, args.min_delta / 1e3)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
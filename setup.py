@@ -15,8 +15,8 @@ setup(
     url="https://github.com/Eugene-Kolesnikov/smdv",
     py_modules=["smdv"],
     entry_points={"console_scripts": ["smdv = smdv:main"]},
-    python_requires=">=3.6",
-    install_requires=["flask", "websockets", "markdown"],
+    python_requires=">=3.7",
+    install_requires=["websockets", "markdown"],
     classifiers=[
         "Topic :: Utilities",
         "Intended Audience :: End Users/Desktop",
@@ -29,22 +29,31 @@ import re
 import sys
 import json
 import time
+import atexit
+import hashlib
 import socket
-import asyncio
+import struct
+import select
+import bisect
+import shutil
 import argparse
+import tempfile
 import warnings
+import functools
+import threading
 import subprocess
-import webbrowser
+import contextlib
 import collections
-import http.client
+import urllib.parse
 
 # 3rd party dependencies
-import flask
-import websockets
-import markdown, mdx_math
+# websockets (for the CLI fallbacks and --bench only)
+# markdown, python-markdown-math
+# These (and the heavier standard library modules) are imported inside the
+# functions that need them, such that the smdv CLI client starts fast.
 
 MARKDOWN_EXTENSIIONS = [
-    mdx_math.MathExtension(enable_dollar_delimiter=True),
+    "mdx_math",
     "abbr",
     "attr_list",
     "def_list",
@@ -57,11 +66,22 @@ MARKDOWN_EXTENSIIONS = [
     "sane_lists",
     "toc"
 ]
+MARKDOWN_EXTENSION_CONFIGS = {"mdx_math": {"enable_dollar_delimiter": True}}
+FAST_MARKDOWN_EXTENSIONS = [  # the extensions of the fast tier (see --fast-render-size)
+    "mdx_math",
+    "fenced_code",
+    "tables",
+    "sane_lists"
+]
+
+MD_INTERPRETERS = {}  # (backend, tier): function converting markdown to html (see md2body)
+MARKDOWN_BACKENDS = ["python-markdown", "markdown-it"]  # see --markdown-backend
 
-MD_INTERPRETER = markdown.Markdown(extensions=MARKDOWN_EXTENSIIONS)
+# markdown-it-py, mdit-py-plugins (for --markdown-backend markdown-it only)
+
+# pynvim (for --nvim-attach only)
 
 # 3rd party CLI dependencies
-# fuser
 # neovim-remote (to edit files with vim)
 
 ## Globals
@@ -69,12 +89,132 @@ ARGS = ""  # the smdv command line arguments
 SMDV_DEFAULT_ARGS = os.environ.get("SMDV_DEFAULT_ARGS", "")  # default smdv arguments
 JSCLIENTS = set()  # jsclients wait for an update from the pyclient
 PYCLIENTS = set()  # pyclients update the html body of the jsclient
-WEBSOCKETS_SERVER = None  # websockets server
+SERVERS = []  # the smdv servers (serving http and websockets on one port)
+CONTROL_SERVER = None  # unix domain socket server for the smdv CLI
+JSCLIENT_WAITERS = []  # futures resolved as soon as a js client registers
+INFLIGHT = set()  # the tasks handling requests (drained on shutdown)
+CONTROL_SOCKET_INODE = None  # to recognize our own control socket
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"  # see RFC 6455
+WEBSOCKET_MAX_SIZE = 16 << 20  # websocket messages larger than this close the connection
 BACKMESSAGES = collections.deque()  # for communication between js and py
 FORWARDMESSAGES = collections.deque()  # for communication between js and py
-EVENT_LOOP = asyncio.get_event_loop()
+EVENT_LOOP = None  # the asyncio event loop (created on first use)
 
 MESSAGE = {}
+BUFFER = {"revision": 0, "lines": []}  # the authoritative buffer of PUT and PATCH requests
+FOLLOW = {}  # the state of the file followed by the follow task (see follow)
+FOLLOW_TASK = None  # the task appending the data appended to a file to the shown file
+FOLLOW_MAX_LINES = 10000  # the default of --follow-max-lines
+FOLLOW_CHUNK_SIZE = 1 << 20  # the (maximum) number of bytes of a followed file read at once
+FOLLOW_INTERVAL = 0.1  # the time between checks for new data in a followed file
+STDIN_STREAM_SIZE = 1 << 20  # stdin larger than this (or slower than 0.5s) is streamed
+NVIM_SESSIONS = {}  # nvim address: pynvim session (running in a thread of its own)
+NVIM_SESSIONS_LOCK = threading.Lock()  # to connect only once to every nvim address
+NVIM_BUFFER = {  # the neovim buffer streamed with --nvim-attach
+    "path": "",  # the path of the file in the buffer
+    "handle": None,  # the neovim buffer handle
+    "lines": [],  # the lines of the buffer
+    "dirty": False,  # whether the lines changed since they were last rendered
+    "task": None,  # the task rendering the lines
+}
+
+## Metrics
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+METRICS = {  # name: (type, help, buckets)
+    "smdv_render_duration_seconds": (
+        "histogram",
+        "time spent rendering content to html",
+        TIME_BUCKETS,
+    ),
+    "smdv_serialize_duration_seconds": (
+        "histogram",
+        "time spent serializing a message to json",
+        TIME_BUCKETS,
+    ),
+    "smdv_broadcast_duration_seconds": (
+        "histogram",
+        "time spent sending a message to all js clients",
+        TIME_BUCKETS,
+    ),
+    "smdv_payload_size_bytes": (
+        "histogram",
+        "size of the received content (in) and of the sent messages (out)",
+        SIZE_BUCKETS,
+    ),
+    "smdv_cache_requests_total": ("counter", "number of cache lookups", None),
+    "smdv_render_tier_total": ("counter", "number of markdown renders per tier", None),
+    "smdv_extension_duration_seconds_total": (
+        "counter",
+        "time spent in the processors of every markdown extension",
+        None,
+    ),
+    "smdv_render_failures_total": (
+        "counter",
+        "number of markdown renders that failed (per reason) and were shown as text",
+        None,
+    ),
+    "smdv_render_tier_size_bytes": (
+        "gauge",
+        "markdown larger than this is rendered in the fast tier first",
+        None,
+    ),
+    "smdv_render_tier_blocks": (
+        "gauge",
+        "markdown with more code blocks and equations than this is rendered in the fast tier first",
+        None,
+    ),
+    "smdv_jsclients": ("gauge", "number of connected js clients", None),
+    "smdv_pyclients": ("gauge", "number of connected py clients", None),
+}
+HISTOGRAMS = {}  # (name, labels): [bucket counts..., sum]
+COUNTERS = collections.Counter()  # (name, labels): value
+
+## Render cache
+RENDER_CACHE = collections.OrderedDict()  # (hash, encoding, static url): (encoding, html)
+RENDER_CACHE_SIZE = 0  # the total size of the html in the render cache
+DISK_CACHE = None  # connection to the persistent (sqlite) render cache
+DISK_CACHE_WRITES = 0  # the number of writes to the disk cache (for eviction)
+SECTION_MIN_SIZE = 10000  # markdown smaller than this is not rendered per section
+STREAM_MIN_SIZE = 200000  # markdown larger than this is sent section by section
+STREAM_FIRST_SIZE = 20000  # the size of the markdown rendered before a streamed file is shown
+PARALLEL_MIN_SIZE = 500000  # markdown larger than this is rendered by --render-workers processes
+ISOLATED_MIN_SIZE = 5000  # markdown smaller than this is rendered in-process (see md2body)
+RENDER_POOL = None  # the process pool rendering markdown (within budgets, and in parallel)
+RENDER_PIDS = None  # the queue on which the workers of the render pool report their pid
+RENDER_THREAD = None  # the thread in which the server renders (see run_render)
+RENDER_FAILURES = {}  # (hash, tier, budgets): the reason the markdown could not be rendered
+PRERENDER_TASK = None  # the task prerendering the files of the current directory
+UPGRADE = {  # the shown file, as far as its sections are rendered (see degraded_md2body)
+    "key": None,  # the render cache key of the full render
+    "sections": [],  # the markdown sections, their html and its tier ("" until rendered)
+    "static_url": "",  # the url to prefix relative links with
+    "tier": "full",  # the render tier of the file
+    "task": None,  # the task rendering the sections
+}
+PRERENDER_MAX_SIZE = 1000000  # files larger than this are never prerendered
+PRERENDER_EXTENSIONS = {".md", ".ipynb"}  # files to prerender (and to open over websocket)
+
+## Files
+TEXT_CHARACTERS = bytes([7, 8, 9, 10, 12, 13, 27, *range(0x20, 0x7F), *range(0x80, 0x100)])
+FILE_TYPES = collections.OrderedDict()  # (path, inode, mtime, size): encoding or "binary"
+FILE_TYPES_MAX = 4096  # the number of file types remembered
+MMAP_MIN_SIZE = 1 << 20  # files larger than this are memory-mapped instead of read
+SIZE_BUDGETS = {"md": 20, "ipynb": 100, "txt": 50, "html": 20}  # default --size-budget (MB)
+
+## Tables
+TABLE_EXTENSIONS = {".csv": ",", ".tsv": "\t"}  # file extensions shown as tables: delimiter
+TABLE_WINDOW = 200  # the number of rows sent at once
+TABLE_INDEX_STEP = 64  # the row offset of every TABLE_INDEX_STEP-th row is indexed
+TABLES = collections.OrderedDict()  # (path, inode, mtime, size): Table (most recent last)
+TABLES_MAX = 4  # the number of tables kept open
+
+## Profiling
+PROFILE = None  # the chrome trace file (only opened with --profile)
+PROFILE_REQUESTS = 0  # the number of requests handled while profiling
+
+## Benchmarks
+BENCH_MARKER = re.compile(r"smdv-bench-\d+-\d+")  # identifies updates sent by --bench
 
 ## Templates
 HTMLTEMPLATE = """
@@ -472,6 +612,18 @@ HTMLTEMPLATE = """
                 ;
                 content: "\E244";
             }}
+            .smdv-table th {{
+                position: sticky;
+                top: 0;
+                cursor: pointer;
+                background-color: #ffffff;
+            }}
+            .smdv-table-query {{
+                margin-bottom: 16px;
+                padding: 5px;
+                width: 100%;
+                box-sizing: border-box;
+            }}
         </style>
         <script src="https://polyfill.io/v3/polyfill.min.js?features=es6"></script>
         <script id="MathJax-script" async src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js"></script>
@@ -513,7 +665,8 @@ HTMLTEMPLATE = """
             // global variables
             var message = {{}};
             var home = "{home}";
-            var websocket = new WebSocket("ws://{host}:{port}/");
+            var websocket = null;
+            var reconnectDelay = 100;
 
             // navbar elements
             var showNavIf = function(element, condition, icon, tooltiptext, tooltipClass="tooltip-bottom", separator="&nbsp;\\n"){{ // &middot;
@@ -548,13 +701,99 @@ HTMLTEMPLATE = """
                 showNavIf(editFile, (message.fileOpen && message.filename != "@pipe" && message.filename != "@put"), "🖋", "edit", tooltipClass = "tooltip-bottom");
             }}
 
+            // append to the body of a followed file (keeping at most update.maxLines lines)
+            var appendBody = function (update) {{
+                var container = document.querySelector("#content .smdv-follow");
+                if (!message.fileOpen || !container) {{
+                    return;
+                }}
+                var atBottom = window.innerHeight + window.scrollY >= document.body.scrollHeight - 2;
+                container.insertAdjacentHTML("beforeend", update.fileBody);
+                while (container.childElementCount > update.maxLines) {{
+                    container.firstElementChild.remove();
+                }}
+                if (update.fileEncoding == "md") {{
+                    MathJax.typeset([container.lastElementChild]);
+                }}
+                if (atBottom) {{
+                    window.scrollTo(0, document.body.scrollHeight);
+                }}
+            }}
+
+            // sections of a streamed file (requested when they are scrolled into view)
+            var sectionObserver = new IntersectionObserver(function (entries) {{
+                entries.forEach(function (entry) {{
+                    if (entry.isIntersecting) {{
+                        sectionObserver.unobserve(entry.target);
+                        sendMessage({{"func":"section", "index":Number(entry.target.dataset.smdvSection),
+                            "fileDegraded":message.fileDegraded}});
+                    }}
+                }});
+            }}, {{"rootMargin": "1000px 0px"}});
+            var observeSections = function () {{
+                sectionObserver.disconnect();
+                document.querySelectorAll("#content [data-smdv-pending]").forEach(function (section) {{
+                    sectionObserver.observe(section);
+                }});
+            }}
+            var upgradeSection = function (update) {{
+                if (!message.fileOpen || update.fileDegraded != message.fileDegraded) {{
+                    return;
+                }}
+                var section = document.querySelector(
+                    '#content [data-smdv-section="' + update.index + '"]');
+                if (section) {{
+                    sectionObserver.unobserve(section);
+                    delete section.dataset.smdvPending;
+                    section.style.minHeight = "";
+                    section.innerHTML = update.fileBody;
+                    MathJax.typeset([section]);
+                }}
+            }}
+
+            // tables (the rows of csv and tsv files are requested window by window)
+            var tableWindow = {{}};
+            var requestRows = function (start) {{
+                var table = document.querySelector("#content .smdv-table");
+                if (!message.fileOpen || !table || tableWindow.loading) {{
+                    return;
+                }}
+                tableWindow.loading = true;
+                sendMessage({{"func":"rows", "start":start, "sort":tableWindow.sort,
+                    "descending":tableWindow.descending, "query":tableWindow.query}});
+            }}
+            var updateRows = function (update) {{
+                var table = document.querySelector("#content .smdv-table");
+                tableWindow.loading = false;
+                if (!table || update.sort !== tableWindow.sort || update.query !== tableWindow.query
+                    || update.descending !== tableWindow.descending) {{
+                    return;
+                }}
+                var body = table.tBodies[0];
+                if (update.start == 0) {{
+                    body.innerHTML = update.fileBody;
+                }} else {{
+                    body.insertAdjacentHTML("beforeend", update.fileBody);
+                }}
+                table.dataset.done = update.done;
+            }}
+            window.addEventListener("scroll", function () {{
+                var table = document.querySelector("#content .smdv-table");
+                if (table && table.dataset.done != "true"
+                    && window.innerHeight + window.scrollY >= document.body.scrollHeight - 500) {{
+                    requestRows(table.tBodies[0].rows.length);
+                }}
+            }});
+
             // body
             var updateBody = function () {{
+                tableWindow = {{"sort":null, "descending":false, "query":""}};
                 if (message.fileOpen) {{
                     document.getElementById("content").innerHTML = message.fileBody;
                 }} else {{
                     document.getElementById("content").innerHTML = message.cwdBody;
                 }}
+                observeSections();
                 MathJax.typeset()
             }}
 
@@ -570,32 +809,54 @@ HTMLTEMPLATE = """
                 websocket.send(JSON.stringify(msg));
             }}
 
-            // websockets
-            websocket.onopen = function() {{
-                // on first connection, let server know there is a new client
-                sendMessage({{"func":"newjsclient"}});
-            }}
-            websocket.onmessage = function (event) {{
-                // parse message
-                message = JSON.parse(event.data);
-                localStorage.pressedButton = "false";
-
-                // update page
-                updateBody()
-                updateNavbar()
-
-                // change browser url
-                // history.pushState({{}}, '');
-                url = (message.fileOpen) ? message.cwd + message.filename : message.cwd
-                history.pushState({{url:url}}, url, url);
-                // window.history.replaceState({{}}, "", url);
-
-                // scroll marker into view
-                marker = document.getElementById("marker");
-                if (marker) {{
-                     marker.scrollIntoView();
+            // websockets (reconnecting when the smdv server restarts)
+            var connect = function() {{
+                websocket = new WebSocket("ws://{host}:{port}/");
+                websocket.onopen = function() {{
+                    reconnectDelay = 100;
+                    // on (re)connection, let server know there is a new client
+                    sendMessage({{"func":"newjsclient"}});
+                }}
+                websocket.onmessage = function (event) {{
+                    // parse message
+                    var data = JSON.parse(event.data);
+                    if (data.func == "append") {{
+                        appendBody(data);
+                        return;
+                    }}
+                    if (data.func == "rows") {{
+                        updateRows(data);
+                        return;
+                    }}
+                    if (data.func == "section") {{
+                        upgradeSection(data);
+                        return;
+                    }}
+                    message = data;
+                    localStorage.pressedButton = "false";
+
+                    // update page
+                    updateBody()
+                    updateNavbar()
+
+                    // change browser url
+                    // history.pushState({{}}, '');
+                    url = (message.fileOpen) ? message.cwd + message.filename : message.cwd
+                    history.pushState({{url:url}}, url, url);
+                    // window.history.replaceState({{}}, "", url);
+
+                    // scroll marker into view
+                    marker = document.getElementById("marker");
+                    if (marker) {{
+                         marker.scrollIntoView();
+                    }}
+                }}
+                websocket.onclose = function() {{
+                    setTimeout(connect, reconnectDelay);
+                    reconnectDelay = Math.min(2 * reconnectDelay, 5000);
                 }}
             }}
+            connect();
 
             // navbar
             homeButton.onclick = function() {{
@@ -659,42 +920,848 @@ HTMLTEMPLATE = """
                 sendMessage({{"func":"editFile"}});
             }}
 
+            // open linked documents over the websocket instead of reloading the page
+            document.getElementById("content").onclick = function(event) {{
+                var column = event.target.closest(".smdv-table th");
+                if (column) {{
+                    var sort = parseInt(column.dataset.column);
+                    tableWindow.descending = (tableWindow.sort === sort) ? !tableWindow.descending : false;
+                    tableWindow.sort = sort;
+                    tableWindow.loading = false;
+                    requestRows(0);
+                    return;
+                }}
+                var link = event.target.closest("a[data-smdv-open]");
+                if (!link || event.button != 0 || event.ctrlKey || event.metaKey || event.shiftKey) {{
+                    return;
+                }}
+                event.preventDefault();
+                sendMessage({{"func":"open", "path":link.dataset.smdvOpen}});
+            }}
+            document.getElementById("content").oninput = function(event) {{
+                if (event.target.classList.contains("smdv-table-query")) {{
+                    clearTimeout(tableWindow.timeout);
+                    tableWindow.timeout = setTimeout(function () {{
+                        tableWindow.query = event.target.value;
+                        tableWindow.loading = false;
+                        requestRows(0);
+                    }}, 300);
+                }}
+            }}
+
         </script>
     </body>
 </html>
 """
 
+# static html page for `smdv --export` (shares the <head> with HTMLTEMPLATE)
+EXPORTTEMPLATE = HTMLTEMPLATE[: HTMLTEMPLATE.index("<body>")] + """<body>
+        <div id="navbar">{navbar}</div>
+        <div class="markdown-body" id="content">{body}</div>
+    </body>
+</html>
+"""
+EXPORT_ENCODINGS = {"md", "ipynb", "txt"}  # file extensions rendered by `smdv --export`
+EXPORT_MANIFEST = ".smdv-export.json"  # manifest written to the export destination
+
+
+## Websockets
+
+# a websocket connection of the smdv server
+class WebSocket:
+    """ a server side websocket connection [RFC 6455]
+
+    Only (fragmented) messages of at most WEBSOCKET_MAX_SIZE bytes, ping/pong and
+    the closing handshake are implemented, with the interface of the websockets package.
+
+    Args:
+        reader: the stream to read the (masked) client frames from
+        writer: the stream to write the (unmasked) server frames to
+    """
+
+    def __init__(self, reader: "asyncio.StreamReader", writer: "asyncio.StreamWriter"):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self.recv()
+        except ConnectionError:
+            raise StopAsyncIteration
+
+    async def close(self, code: int = 1000):
+        """ start (or finish) the closing handshake and close the connection
+
+        Args:
+            code: the close status code
+        """
+        if not self.closed:
+            self.closed = True
+            try:
+                await self.write_frame(0x8, struct.pack("!H", code))
+            except ConnectionError:
+                pass
+        self.writer.close()
+
+    async def recv(self) -> str:
+        """ receive a message
+
+        Returns:
+            message: str: the received message
+
+        Raises:
+            ConnectionError: when the connection is closed
+        """
+        import asyncio
+
+        fragments, size = [], 0
+        while True:
+            try:
+                head = await self.reader.readexactly(2)
+                length = head[1] & 0x7F
+                if length == 126:
+                    (length,) = struct.unpack("!H", await self.reader.readexactly(2))
+                elif length == 127:
+                    (length,) = struct.unpack("!Q", await self.reader.readexactly(8))
+                size += length
+                if size > WEBSOCKET_MAX_SIZE:
+                    await self.close(1009)  # message too big
+                    raise ConnectionAbortedError("websocket message too big")
+                mask = await self.reader.readexactly(4) if head[1] & 0x80 else b""
+                payload = await self.reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                self.closed = True
+                raise ConnectionResetError("websocket connection lost")
+            if mask:  # xor the payload with the repeated 4-byte mask
+                mask = (mask * (length // 4 + 1))[:length]
+                payload = int.from_bytes(payload, "big") ^ int.from_bytes(mask, "big")
+                payload = payload.to_bytes(length, "big")
+            opcode = head[0] & 0x0F
+            if opcode == 0x8:  # close
+                await self.close()
+                raise ConnectionAbortedError("websocket connection closed")
+            if opcode == 0x9:  # ping
+                await self.write_frame(0xA, payload)
+                continue
+            if opcode == 0xA:  # pong
+                continue
+            fragments.append(payload)
+            if head[0] & 0x80:  # final fragment
+                return b"".join(fragments).decode()
+
+    async def send(self, message: str):
+        """ send a (text) message
+
+        Args:
+            message: the message to send
+        """
+        if self.closed:
+            raise ConnectionAbortedError("websocket connection closed")
+        await self.write_frame(0x1, message.encode())
+
+    async def write_frame(self, opcode: int, payload: bytes):
+        """ write a single (final) frame
+
+        Args:
+            opcode: the frame opcode
+            payload: the frame payload
+        """
+        length = len(payload)
+        if length < 126:
+            head = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 2 ** 16:
+            head = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        self.writer.write(head + payload)
+        await self.writer.drain()
+
+
+## Tables
+
+# a csv or tsv file, indexed by row offsets
+class Table:
+    """ a csv (or tsv) file, lazily indexed by row offsets
+
+    Only the offset of every TABLE_INDEX_STEP-th row is kept, and only as far as
+    rows are requested.
+
+    Args:
+        path: the path of the file
+        delimiter: the field delimiter ("," for csv, tab for tsv)
+    """
+
+    def __init__(self, path: str, delimiter: str):
+        import mmap, array
+
+        self.path = path
+        self.delimiter = delimiter
+        self.lock = threading.Lock()
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        end = self.row_end(0)
+        self.header = (self.parse(0, end) or [[]])[0]
+        self.offsets = array.array("Q", [end])  # the offset of row 0, TABLE_INDEX_STEP, ...
+        self.indexed = 0  # the number of indexed rows
+        self.indexed_end = end  # the end of the last indexed row
+
+    def close(self):
+        """ unmap the file """
+        if not isinstance(self.data, bytes):
+            self.data.close()
+
+    def index(self, row: int) -> bool:
+        """ extend the index up to (and including) a row
+
+        Args:
+            row: the row to index
+
+        Returns:
+            exists: bool: whether the file contains the row
+        """
+        while self.indexed <= row and self.indexed_end < len(self.data):
+            self.indexed_end = self.row_end(self.indexed_end)
+            self.indexed += 1
+            if self.indexed % TABLE_INDEX_STEP == 0:
+                self.offsets.append(self.indexed_end)
+        return row < self.indexed
+
+    def parse(self, start: int, end: int) -> list:
+        """ parse the rows between two byte offsets
+
+        Args:
+            start: the offset of the first row
+            end: the offset after the last row
+
+        Returns:
+            rows: list: the rows (lists of fields)
+        """
+        import csv
+
+        text = self.data[start:end].decode(errors="replace")
+        return list(csv.reader(io.StringIO(text, newline=""), delimiter=self.delimiter))
+
+    def row_end(self, start: int) -> int:
+        """ find the end of a row (taking newlines in quoted fields into account)
+
+        Args:
+            start: the offset of the row
+
+        Returns:
+            end: int: the offset after the row
+        """
+        end, quotes = start, 0
+        while True:
+            newline = self.data.find(b"\n", end)
+            newline = len(self.data) if newline < 0 else newline + 1
+            quotes += self.data[end:newline].count(b'"')
+            end = newline
+            if quotes % 2 == 0 or end >= len(self.data):
+                return end
+
+    def rows(self, start: int, count: int) -> tuple:
+        """ get a window of rows (in file order)
+
+        Args:
+            start: the first row of the window
+            count: the number of rows in the window
+
+        Returns:
+            rows: list: the rows of the window
+            done: bool: whether the window contains the last row
+        """
+        with self.lock:
+            done = not self.index(start + count)
+            if start >= self.indexed:
+                return [], True
+            offset = self.offsets[start // TABLE_INDEX_STEP]
+            for _ in range(start % TABLE_INDEX_STEP):
+                offset = self.row_end(offset)
+            end = offset
+            for _ in range(min(count, self.indexed - start)):
+                end = self.row_end(end)
+        return self.parse(offset, end), done
+
+    def scan(self):
+        """ iterate over all rows of the file (without indexing them)
+
+        Yields:
+            row: list: the fields of the next row
+        """
+        import csv
+
+        with open(self.path, "r", errors="replace", newline="") as file:
+            file.seek(self.offsets[0])
+            yield from csv.reader(file, delimiter=self.delimiter)
+
+    def window(
+        self, start: int, count: int, sort: int = None, descending: bool = False, query: str = ""
+    ) -> tuple:
+        """ get a window of rows, optionally filtered and sorted
+
+        Args:
+            start: the first row of the window
+            count: the number of rows in the window
+            sort: the column to sort by (None to keep the file order)
+            descending: whether to sort in descending order
+            query: only keep the rows containing query (case insensitive)
+
+        Returns:
+            rows: list: the rows of the window
+            done: bool: whether the window contains the last row
+        """
+        import heapq, itertools
+
+        if sort is None and not query:
+            return self.rows(start, count)
+        rows = self.scan()
+        if query:
+            query = query.lower()
+            rows = (row for row in rows if query in self.delimiter.join(row).lower())
+        if sort is None:
+            rows = list(itertools.islice(rows, start, start + count + 1))
+        else:
+
+            def key(row):  # numbers before (and sorted as) numbers, then text
+                field = row[sort] if sort < len(row) else ""
+                try:
+                    return (0, float(field), "")
+                except ValueError:
+                    return (1, 0.0, field.lower())
+
+            select = heapq.nlargest if descending else heapq.nsmallest
+            rows = select(start + count + 1, rows, key=key)[start:]
+        return rows[:count], len(rows) <= count
+
 
 ## Async functions (alphabetic)
 
 # as number of js clients
 async def ask_num_js_clients():
     """ ask the number of js clients from the websocket server """
+    import websockets
+
     async with websockets.connect(
-        f"ws://{ARGS.websocket_host}:{ARGS.websocket_port}"
+        f"ws://{ARGS.host}:{ARGS.port}"
     ) as websocket:
         await websocket.send(json.dumps({"client": "py", "func": "numJSClients"}))
         num_clients = await websocket.recv()
     return int(num_clients)
 
 
+# load test the smdv server
+async def benchmark(jsclients: int, producers: int, rate: float, duration: float) -> dict:
+    """ load test the running smdv server with fake js clients and producers
+
+    Args:
+        jsclients: the number of fake js (browser) clients to connect
+        producers: the number of producers sending updates
+        rate: the number of updates per second sent by each producer
+        duration: the time (in seconds) the producers keep sending updates
+
+    Returns:
+        stats: dict: the sent timestamps and received timestamps per update
+    """
+    import asyncio
+
+    stats = {"sent": {}, "received": collections.defaultdict(list)}
+    stop = asyncio.Event()
+    ready = [asyncio.Event() for _ in range(jsclients)]
+    clients = [
+        asyncio.ensure_future(benchmark_jsclient(stats["received"], ready[i], stop))
+        for i in range(jsclients)
+    ]
+    await asyncio.gather(*[event.wait() for event in ready])
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[benchmark_producer(i, stats["sent"], rate, duration) for i in range(producers)]
+    )
+    stats["duration"] = time.perf_counter() - start
+    await asyncio.sleep(2.0)  # grace period for updates still in flight
+    stop.set()
+    await asyncio.gather(*clients)
+    return stats
+
+
+# fake js client for the benchmark
+async def benchmark_jsclient(received: dict, ready: "asyncio.Event", stop: "asyncio.Event"):
+    """ a fake js client speaking the same protocol as the HTMLTEMPLATE client
+
+    Args:
+        received: the receive timestamps per benchmark update (will be updated)
+        ready: event to set once the client is registered
+        stop: event signaling the client to disconnect
+    """
+    import asyncio, websockets
+
+    async with websockets.connect(
+        f"ws://{ARGS.host}:{ARGS.port}", max_size=None
+    ) as websocket:
+        await websocket.send(json.dumps({"func": "newjsclient", "client": "js"}))
+        await websocket.recv()  # the current message is sent on registration
+        ready.set()
+        while not stop.is_set():
+            try:
+                message = await asyncio.wait_for(websocket.recv(), 0.1)
+            except asyncio.TimeoutError:
+                continue
+            timestamp = time.perf_counter()
+            match = BENCH_MARKER.search(message)
+            if match:
+                received[match.group(0)].append(timestamp)
+
+
+# producer sending updates for the benchmark
+async def benchmark_producer(producer: int, sent: dict, rate: float, duration: float):
+    """ send updates to the smdv server at a fixed rate
+
+    Args:
+        producer: the index of the producer
+        sent: the send timestamps per benchmark update (will be updated)
+        rate: the number of updates per second to send
+        duration: the time (in seconds) to keep sending updates
+    """
+    import asyncio
+
+    body = "\n\n".join(["lorem ipsum dolor sit amet " * 10] * (ARGS.bench_size // 280 + 1))
+    start = time.perf_counter()
+    for i in range(int(rate * duration)):
+        await asyncio.sleep(max(0.0, start + i / rate - time.perf_counter()))
+        marker = f"smdv-bench-{producer}-{i}"
+        content = f"# {marker}\n\n{body}"
+        sent[marker] = time.perf_counter()
+        if ARGS.bench_via == "put":
+            await event_loop().run_in_executor(None, send_put_request, content)
+            continue
+        message = {
+            "func": "file",
+            "cwd": "/",
+            "cwdBody": "",
+            "cwdEncoded": True,
+            "filename": "@put",
+            "fileBody": content,
+            "fileCwd": "/",
+            "fileOpen": True,
+            "fileEncoding": "md",
+            "fileEncoded": False,
+        }
+        if ARGS.bench_via == "control":
+            await event_loop().run_in_executor(None, functools.partial(
+                control_request, "push", message=message
+            ))
+            continue
+        await send_as_pyclient_async(message)
+
+
+# follow a growing file
+async def follow(
+    path: str,
+    filename: str,
+    cwd: str,
+    encoding: str,
+    spool: bool = False,
+    tail: bool = False,
+    max_lines: int = FOLLOW_MAX_LINES,
+):
+    """ show a growing file, appending the data appended to the file to the shown file
+
+    Following stops when another file is shown, or when the file stopped growing
+    (see the follow_end control command).
+
+    Args:
+        path: the (absolute) path of the file to follow
+        filename: the filename to show the file with (e.g. @pipe for stdin)
+        cwd: the directory (relative to the smdv home) to show the file in
+        encoding: the encoding to render the file with (md, html or txt)
+        spool: whether the file is a spool file, to be removed after following it
+        tail: whether to start at the end of the file (instead of reading all of it)
+        max_lines: the number of lines (or markdown blocks) to keep
+    """
+    import asyncio
+
+    global FOLLOW_TASK
+    if encoding not in {"md", "html"}:
+        encoding = "txt"
+    if encoding == "txt":
+        opening, closing = '<div class="codehilite"><pre><code class="smdv-follow">', "</code></pre></div>"
+    else:
+        opening, closing = '<div class="smdv-follow">', "</div>"
+    FOLLOW.clear()
+    FOLLOW.update(
+        path=path,
+        filename=filename,
+        cwd=cwd,
+        encoding=encoding,
+        opening=opening,
+        closing=closing,
+        ended=False,
+        stale=False,
+        pending=b"",
+        fragments=collections.deque(maxlen=max_lines),
+    )
+    file = open(path, "rb")
+    try:
+        if tail and os.fstat(file.fileno()).st_size > FOLLOW_CHUNK_SIZE:
+            file.seek(-FOLLOW_CHUNK_SIZE, os.SEEK_END)
+            await event_loop().run_in_executor(None, file.readline)  # skip the partial line
+        message = {
+            "func": "file",
+            "cwd": cwd,
+            "cwdBody": cached_dir2body(cwd),
+            "cwdEncoded": True,
+            "filename": filename,
+            "fileBody": opening + closing,
+            "fileCwd": cwd,
+            "fileOpen": True,
+            "fileEncoding": encoding,
+            "fileEncoded": True,
+        }
+        await handle_message(None, message)
+        while MESSAGE.get("filename") == filename and MESSAGE.get("fileCwd") == cwd:
+            data = await event_loop().run_in_executor(None, file.read, FOLLOW_CHUNK_SIZE)
+            if not data and not spool:  # check whether the file was truncated or replaced
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    stat = None  # replaced, but the new file is not there yet
+                if stat is not None and stat.st_ino != os.fstat(file.fileno()).st_ino:
+                    file.close()
+                    file = open(path, "rb")
+                    continue
+                if stat is not None and stat.st_size < file.tell():
+                    file.seek(0)
+                    FOLLOW["pending"] = b""
+                    FOLLOW["fragments"].clear()
+                    FOLLOW["stale"] = True
+                    await send_message_to_all_js_clients()
+                    continue
+            ended = not data and FOLLOW["ended"]
+            fragments = await run_render(follow_render, data, final=ended)
+            if fragments:
+                FOLLOW["fragments"].extend(fragments)
+                FOLLOW["stale"] = True  # (the body is joined when it is needed, see follow_body)
+                update = json.dumps(
+                    {
+                        "func": "append",
+                        "fileBody": "".join(fragments[-max_lines:]),
+                        "fileEncoding": encoding,
+                        "maxLines": max_lines,
+                    }
+                )
+                observe_metric("smdv_payload_size_bytes", len(update), direction="out")
+                await asyncio.gather(
+                    *[client.send(update) for client in JSCLIENTS], return_exceptions=True
+                )
+            if ended:
+                return
+            if not data:
+                await asyncio.sleep(FOLLOW_INTERVAL)
+    finally:
+        file.close()
+        if spool:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+        if FOLLOW.get("path") == path:
+            follow_body()
+            FOLLOW.clear()
+            FOLLOW_TASK = None
+
+
+# handle a request sent over the control socket
+async def handle_control_request(request: dict) -> dict:
+    """ handle a request sent over the control socket
+
+    Args:
+        request: the request. The command to execute is given by the "cmd" key:
+            status: ask the status of the server
+            clients: ask the number of connected js clients
+            wait_jsclient: wait (at most "timeout" seconds) until a js client is
+                connected
+            open: open the file at "path" (relative to the smdv home)
+            push: handle the websocket "message" as if sent by a py client
+            follow: show the growing file at (the absolute) "path" as
+                "filename" (in the directory "cwd") rendered as "encoding",
+                keeping "max_lines" lines, optionally starting at its "tail"
+                (see follow). The file is either in the smdv home or a
+                "spool" file of send_message_from_stdin
+            follow_end: the followed file at "path" stopped growing
+            shutdown: stop the server (gracefully)
+            restart: start a new server with the command line arguments
+                "args", which takes over the listening sockets (and the
+                current message) of this server, and stop this server
+
+    Returns:
+        response: dict: the response (contains "ok": False and an "error" on failure)
+    """
+    import asyncio
+
+    global FOLLOW_TASK
+    command = request.get("cmd")
+    if command == "status":
+        return {"ok": True, "pid": os.getpid(), "jsclients": len(JSCLIENTS)}
+    if command == "clients":
+        return {"ok": True, "jsclients": len(JSCLIENTS)}
+    if command == "wait_jsclient":
+        if not JSCLIENTS:
+            waiter = event_loop().create_future()
+            JSCLIENT_WAITERS.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, request.get("timeout", 10.0))
+            except asyncio.TimeoutError:
+                return {"ok": False, "error": "no js client connected"}
+        return {"ok": True, "jsclients": len(JSCLIENTS)}
+    if command in {"open", "push"}:
+        if command == "open":
+            message = file_message(request["path"])
+            message["nvimAddress"] = request.get("nvimAddress", ARGS.nvim_address)
+        else:
+            message = request["message"]
+        # don't let the client wait for the message to be rendered:
+        track(handle_message(None, message))
+        return {"ok": True}
+    if command == "follow":
+        path = request["path"]
+        if not request.get("spool", False):
+            path = home_path(os.path.relpath(path, ARGS.home))
+        elif (
+            os.path.dirname(path) != tempfile.gettempdir()
+            or not os.path.basename(path).startswith("smdv-stdin-")
+        ):  # (see send_message_from_stdin)
+            raise FileNotFoundError(f"{path} is no spool file of smdv")
+        home_path(request["cwd"])
+        if FOLLOW_TASK is not None:
+            FOLLOW_TASK.cancel()
+        FOLLOW_TASK = asyncio.ensure_future(
+            follow(
+                path,
+                request.get("filename", os.path.basename(request["path"])),
+                request["cwd"],
+                request.get("encoding", "txt"),
+                spool=request.get("spool", False),
+                tail=request.get("tail", False),
+                max_lines=request.get("max_lines", FOLLOW_MAX_LINES),
+            )
+        )
+        return {"ok": True}
+    if command == "follow_end":
+        if FOLLOW.get("path") == request["path"]:
+            FOLLOW["ended"] = True
+        return {"ok": True}
+    if command == "shutdown":
+        close_server()
+        asyncio.ensure_future(shutdown())
+        return {"ok": True}
+    if command == "restart":
+        sockets = [sock for server in SERVERS for sock in server.sockets]
+        pid = await event_loop().run_in_executor(
+            None,
+            functools.partial(
+                run_server_in_subprocess,
+                request["args"],
+                listen_fds=[sock.fileno() for sock in sockets],
+                timeout=request.get("timeout", 10.0),
+            ),
+        )
+        if not pid:
+            return {"ok": False, "error": "the new smdv server could not be started"}
+        close_server()
+        if MESSAGE:  # show the current message in the new server as well
+            follow_body()
+            await event_loop().run_in_executor(
+                None, functools.partial(control_request, "push", message=dict(MESSAGE))
+            )
+        asyncio.ensure_future(shutdown())
+        return {"ok": True, "pid": pid}
+    return {"ok": False, "error": f"unknown command {command!r}"}
+
+
+# handle an http request
+async def handle_http_request(method: str, path: str, headers: dict, body: bytes) -> tuple:
+    """ handle an http request to the smdv server
+
+    Routes:
+        GET /@metrics: the metrics in the prometheus text exposition format
+        GET /@static/<path>: the (raw) file at path
+        GET /<path>/: the smdv page showing path (a directory or a file)
+        PUT /: show the markdown in the request body (like editor plugins do)
+        PATCH /: replace line ranges of the markdown shown by PUT (see BUFFER)
+        DELETE /: stop the smdv server
+
+    Args:
+        method: the request method
+        path: the (unquoted) request path
+        headers: the request headers (with lowercase names)
+        body: the request body
+
+    Returns:
+        response: tuple: the status, the response headers and the response body
+    """
+    try:
+        home_path(path)
+    except FileNotFoundError:
+        return 404, {}, b"not found.\n"
+
+    if method in {"GET", "HEAD"} and path == "/@metrics":
+        snapshot = metrics_snapshot(
+            server="smdv",
+            smdv_jsclients=len(JSCLIENTS),
+            smdv_pyclients=len(PYCLIENTS),
+            smdv_render_tier_size_bytes=ARGS.fast_render_size * 1e6,
+            smdv_render_tier_blocks=ARGS.fast_render_blocks,
+        )
+        return (
+            200,
+            {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+            metrics2text(snapshot).encode(),
+        )
+
+    if method in {"GET", "HEAD"} and path.startswith("/@static/"):
+        return static_file(path[len("/@static/") :], headers)
+
+    if method in {"GET", "HEAD"}:
+        if not path.endswith("/"):
+            return 308, {"Location": urllib.parse.quote(path) + "/"}, b""
+        path = path[1:-1]
+        try:
+            cwd, filename = change_current_working_directory(path)
+        except FileNotFoundError:
+            return 404, {}, b"not found.\n"
+
+        html = HTMLTEMPLATE.format(
+            home=ARGS.home,
+            interactive=f"{'--interactive' if ARGS.interactive else ''}",
+            md_css_cdn=ARGS.md_css_cdn,
+            host=ARGS.host,
+            port=ARGS.port,
+        )
+        if filename:
+            if is_binary_file(filename):
+                return 302, {"Location": urllib.parse.quote(f"/@static/{path}")}, b""
+            try:
+                message = file_message(path)
+            except (OSError, UnicodeDecodeError):
+                return 404, {}, b"not found.\n"
+        else:  # this only happens if requested path is a directory
+            message = {
+                "func": "dir",
+                "cwd": cwd,
+                "cwdBody": dir2body(cwd),
+                "cwdEncoded": True,
+                "filename": filename,
+                "fileBody": "",
+                "fileCwd": cwd,
+                "fileOpen": False,
+                "fileEncoding": "",
+                "fileEncoded": False,
+            }
+        await handle_message(None, message)
+        return 200, {"Content-Type": "text/html; charset=utf-8"}, html.encode()
+
+    if method == "PUT" and path == "/":
+        try:
+            BUFFER["lines"] = body.decode().split("\n")
+        except UnicodeDecodeError as e:
+            return 400, {}, f"invalid body: {e!r}\n".encode()
+        BUFFER["revision"] += 1
+        await handle_message(None, buffer_message())
+        return 200, {"Smdv-Revision": BUFFER["revision"]}, b""
+
+    if method == "PATCH" and path == "/":
+        try:
+            patch = json.loads(body)
+            revision, changes = int(patch["revision"]), patch["changes"]
+            changes = [(int(c["start"]), int(c["end"]), c["lines"]) for c in changes]
+            for _, _, replacement in changes:
+                if not isinstance(replacement, list) or not all(
+                    isinstance(line, str) for line in replacement
+                ):
+                    raise TypeError(f"lines should be a list of strings: {replacement!r}")
+        except (ValueError, TypeError, KeyError) as e:
+            return 400, {}, f"invalid patch: {e!r}\n".encode()
+        if revision != BUFFER["revision"]:
+            return 409, {"Smdv-Revision": BUFFER["revision"]}, b"revision mismatch.\n"
+        lines = list(BUFFER["lines"])  # the buffer is only changed when all changes apply
+        for start, end, replacement in changes:
+            if not 0 <= start <= end <= len(lines):
+                return 400, {}, f"invalid line range: [{start}, {end}).\n".encode()
+            lines[start:end] = replacement
+        BUFFER["lines"] = lines
+        BUFFER["revision"] += 1
+        await handle_message(None, buffer_message())
+        return 200, {"Smdv-Revision": BUFFER["revision"]}, b""
+
+    if method == "DELETE" and path == "/":
+        import asyncio
+
+        close_server()
+        asyncio.ensure_future(shutdown())
+        return 200, {}, b"success.\n"
+
+    return 405, {}, b"method not allowed.\n"
+
+
 # handle a message sent by one of the clients:
-async def handle_message(client: websockets.WebSocketServerProtocol, message: str):
+async def handle_message(client: "WebSocket", message: str):
     """ handle a message sent by one of the clients
 
     Args:
         message: the message to update the global message with
     """
+    import asyncio
+
+    global PRERENDER_TASK
     func = message.get("func")
     ARGS.nvim_address = message.pop("nvimAddress", ARGS.nvim_address)
     validate_message(message)
     if "cwd" in message:
-        os.chdir(ARGS.home + message["cwd"])
+        os.chdir(home_path(message["cwd"]))
     if not func:
         return
     if func == "numJSClients":
         await client.send(str(len(JSCLIENTS)))
         return
+    if func == "rows":  # a window of the shown table
+        path = ARGS.home + MESSAGE.get("fileCwd", "") + MESSAGE.get("filename", "")
+        window = functools.partial(
+            table_window,
+            path,
+            int(message.get("start", 0)),
+            message.get("sort"),
+            bool(message.get("descending")),
+            str(message.get("query", "")),
+        )
+        try:
+            body, done = await event_loop().run_in_executor(None, window)
+        except (OSError, ValueError, KeyError):
+            body, done = "", True  # the shown file is no table (anymore)
+        message.update(fileBody=body, done=done)
+        await client.send(json.dumps(message))
+        return
+    if func == "section":  # a section of the shown file (see degraded_md2body)
+        key, tier, index = UPGRADE["key"], UPGRADE["tier"], message.get("index")
+        if key is not None and message.get("fileDegraded") == key[0] and isinstance(index, int):
+            with timed("render_section", tier=tier):
+                html = await run_render(render_section, index, tier, key)
+            # (unless another file was shown in the meantime):
+            if html is not None and UPGRADE["key"] is not None and UPGRADE["key"] == key:
+                message["fileBody"] = html
+                await client.send(json.dumps(message))
+        return
+    if PRERENDER_TASK is not None:
+        PRERENDER_TASK.cancel()  # real requests have priority over prerendering
+    if func == "open":
+        path = urllib.parse.unquote(message["path"])
+        try:
+            message = file_message(path)
+        except (OSError, UnicodeDecodeError):
+            return
+        await handle_message(client, message)
+        return
     if func == "editFile":
         edit_in_neovim(ARGS.home + MESSAGE["fileCwd"] + MESSAGE["filename"])
         return
@@ -716,6 +1783,7 @@ async def handle_message(client: websockets.WebSocketServerProtocol, message: st
             and MESSAGE.get("filename")
             and not message.pop("forceClose", False)
         ):
+            follow_body()
             message["filename"] = MESSAGE["filename"]
             message["fileCwd"] = MESSAGE["fileCwd"]
             message["fileBody"] = MESSAGE["fileBody"]
@@ -725,17 +1793,89 @@ async def handle_message(client: websockets.WebSocketServerProtocol, message: st
             message["cwdBody"] = dir2body(message["cwd"])
             message["cwdEncoded"] = True
     if func == "file":
-        encode(message)
+        if UPGRADE["task"] is not None:
+            UPGRADE["task"].cancel()  # the previous file is not shown anymore
+        message.setdefault("fileDegraded", "")
+        # (the static url is of the current directory, which may change meanwhile):
+        await run_render(encode, message, get_static_url(), degrade=True)
+        if UPGRADE["task"] is not None:
+            UPGRADE["task"].cancel()  # of a file shown while this one was rendered
     if func in {"dir", "file"}:
         MESSAGE.update(message)
-        if ARGS.interactive and MESSAGE["func"]=="file":
-            edit_in_neovim(ARGS.home + MESSAGE["fileCwd"] + MESSAGE["filename"])
+        path = ARGS.home + MESSAGE.get("fileCwd", "") + MESSAGE["filename"]
+        if ARGS.interactive and MESSAGE["func"]=="file" and path != NVIM_BUFFER["path"]:
+            edit_in_neovim(path)
+        if ARGS.nvim_attach and MESSAGE["func"] == "file" and not MESSAGE["filename"].startswith("@"):
+            nvim_attach(path)
         await send_message_to_all_js_clients()
+        if func == "file" and message["fileDegraded"]:
+            # (unless another file was rendered in the meantime):
+            if UPGRADE["key"] is not None and UPGRADE["key"][0] == message["fileDegraded"]:
+                UPGRADE["task"] = asyncio.ensure_future(upgrade_sections())
+        elif ARGS.prerender_budget > 0:
+            if func == "dir":  # prerender the files in the directory
+                paths = [message["cwd"]]
+            else:  # prefetch the documents linked to from the file
+                paths = re.findall('data-smdv-open="(.*?)"', MESSAGE["fileBody"])
+                paths = [urllib.parse.unquote(path) for path in paths]
+            PRERENDER_TASK = asyncio.ensure_future(prerender(paths))
         return
 
 
+# prerender files
+async def prerender(paths: list):
+    """ render md and ipynb files into the render cache
+
+    Smallest (and most recent) files first, within --prerender-budget seconds.
+
+    Args:
+        paths: the files to prerender (relative to the smdv home). When a
+            directory is given, the md and ipynb files in that directory are
+            prerendered.
+    """
+    import asyncio
+
+    deadline = time.perf_counter() + ARGS.prerender_budget
+    files = []
+    for path in paths:
+        try:
+            path = home_path(path)  # (links in a document may point outside of the home)
+        except FileNotFoundError:
+            continue
+        try:
+            entries = list(os.scandir(path)) if os.path.isdir(path) else [path]
+        except OSError:
+            continue
+        for entry in entries:
+            entry = getattr(entry, "path", entry)
+            if os.path.splitext(entry)[1] not in PRERENDER_EXTENSIONS:
+                continue
+            try:
+                stat = os.stat(entry)
+            except OSError:
+                continue
+            if stat.st_size <= PRERENDER_MAX_SIZE and os.path.isfile(entry):
+                files.append((stat.st_size, -stat.st_mtime, entry))
+    for size, _, filename in sorted(set(files)):
+        await asyncio.sleep(0)  # allow cancellation by real requests
+        if time.perf_counter() > deadline:
+            return
+        if RENDER_CACHE_SIZE + 2 * size > ARGS.render_cache_size * 1e6:
+            return
+        try:  # (reading large files takes a while, just like rendering them)
+            if await run_render(file_type, filename) == "binary":
+                continue
+            content, digest = await run_render(read_file, filename, filename_encoding(filename))
+        except (OSError, UnicodeDecodeError):
+            continue  # unreadable files are not prerendered
+        message = {"filename": os.path.basename(filename), "fileBody": content, "fileDigest": digest}
+        cwd = os.path.dirname(filename)[len(ARGS.home) :] + "/"
+        with span("prerender", filename=filename):
+            await run_render(encode, message, static_url=get_static_url(cwd))
+
+
 # register websocket client
-async def register_client(client: websockets.WebSocketServerProtocol):
+async def register_client(client: "WebSocket"):
     """ register a client
 
     This function registers a client (websocket) in either the set of
@@ -753,12 +1893,40 @@ async def register_client(client: websockets.WebSocketServerProtocol):
     clienttype = message.get("client", "")
     if clienttype == "js":
         JSCLIENTS.add(client)
+        follow_body()
         await client.send(json.dumps(MESSAGE))
+        for waiter in JSCLIENT_WAITERS:
+            if not waiter.done():
+                waiter.set_result(len(JSCLIENTS))
+        JSCLIENT_WAITERS.clear()
     elif clienttype == "py":
         PYCLIENTS.add(client)
     else:
         raise ValueError("not a valid client identifier specified.")
-    await handle_message(client, message)
+    with span("handle_message", sample=True, func=message.get("func", "")):
+        await handle_message(client, message)
+
+
+# render in the render thread
+async def run_render(function, *args, **kwargs):
+    """ call a (blocking) rendering function in the render thread
+
+    Args:
+        function: the function to call (such as encode or render_section)
+        *args: the arguments of the function
+        **kwargs: the keyword arguments of the function
+
+    Returns:
+        result: the result of the function
+    """
+    import concurrent.futures
+
+    global RENDER_THREAD
+    if RENDER_THREAD is None:
+        RENDER_THREAD = concurrent.futures.ThreadPoolExecutor(1, "smdv-render")
+    return await event_loop().run_in_executor(
+        RENDER_THREAD, functools.partial(function, *args, **kwargs)
+    )
 
 
 # python websocket client
@@ -768,30 +1936,15 @@ async def send_as_pyclient_async(message: dict):
     Args:
         message: the message to send (in dictionary format)
     """
+    import websockets
+
     message["client"] = "py"
     async with websockets.connect(
-        f"ws://{ARGS.websocket_host}:{ARGS.websocket_port}"
+        f"ws://{ARGS.host}:{ARGS.port}"
     ) as websocket:
         await websocket.send(json.dumps(message))
 
 
-# serve clients
-async def serve_client(client: websockets.WebSocketServerProtocol, path: str):
-    """ asynchronous websocket server to serve a websocket client
-
-    Args:
-        client: the client (websocket) to serve.
-        path: the path over which to serve
-
-    """
-    await register_client(client)
-    try:
-        async for message in client:
-            await handle_message(client, json.loads(message))
-    finally:
-        await unregister_client(client)
-
-
 # send updated body contents to javascript clients
 async def send_message_to_all_js_clients():
     """ send a message to all js clients
@@ -800,6 +1953,8 @@ async def send_message_to_all_js_clients():
         message: dict: the message to send
 
     """
+    import asyncio
+
     if (not BACKMESSAGES) or (MESSAGE["cwd"] != BACKMESSAGES[0]["cwd"]):
         BACKMESSAGES.appendleft(
             {
@@ -819,36 +1974,353 @@ async def send_message_to_all_js_clients():
         if len(BACKMESSAGES) > 20:
             BACKMESSAGES.pop()
     if JSCLIENTS:
-        await asyncio.wait([client.send(json.dumps(MESSAGE)) for client in JSCLIENTS])
+        follow_body()
+        start = time.perf_counter()
+        message = json.dumps(MESSAGE)
+        observe_metric("smdv_serialize_duration_seconds", time.perf_counter() - start)
+        observe_metric("smdv_payload_size_bytes", len(message), direction="out")
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[client.send(message) for client in JSCLIENTS], return_exceptions=True
+        )
+        observe_metric("smdv_broadcast_duration_seconds", time.perf_counter() - start)
 
 
-# unregister websocket client
-async def unregister_client(client: websockets.WebSocketServerProtocol):
-    """ unregister a client
+# serve clients
+async def serve_client(client: "WebSocket", path: str):
+    """ asynchronous websocket server to serve a websocket client
 
     Args:
-        client: the client (websocket) to unregister.
+        client: the client (websocket) to serve.
+        path: the path over which to serve
 
     """
-    if client in JSCLIENTS:
-        JSCLIENTS.remove(client)
-    if client in PYCLIENTS:
-        PYCLIENTS.remove(client)
+    await register_client(client)
+    try:
+        async for message in client:
+            message = json.loads(message)
+            with span("handle_message", sample=True, func=message.get("func", "")):
+                await track(handle_message(client, message))
+    finally:
+        await unregister_client(client)
 
 
-## Normal functions (alphabetic)
+# serve clients of the control socket
+async def serve_control_client(reader: "asyncio.StreamReader", writer: "asyncio.StreamWriter"):
+    """ serve a client of the control socket
 
-# function to change the current working directory
-def change_current_working_directory(path: str) -> str:
-    """ change the current working directory
+    Both requests and responses are json objects, prefixed by their length as
+    4-byte big-endian unsigned integer.
 
     Args:
-        path: filename or directory name. If a filename is given,
-            the current directory will be changed to the containing
-            folder
+        reader: the stream to read the requests from
+        writer: the stream to write the responses to
     """
-    i = 1 if (path and path[0] == "/") else 0
-    fullpath = os.path.join(ARGS.home, path[i:])
+    import asyncio
+
+    try:
+        while True:
+            (length,) = struct.unpack("!I", await reader.readexactly(4))
+            request = json.loads(await reader.readexactly(length))
+            with span("control", sample=True, cmd=request.get("cmd", "")):
+                try:
+                    response = await handle_control_request(request)
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+            response = json.dumps(response).encode()
+            writer.write(struct.pack("!I", len(response)) + response)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass  # client disconnected
+    finally:
+        writer.close()
+
+
+# serve clients of the smdv server
+async def serve_http_client(reader: "asyncio.StreamReader", writer: "asyncio.StreamWriter"):
+    """ serve a client of the smdv server
+
+    Args:
+        reader: the stream to read the requests from
+        writer: the stream to write the responses to
+    """
+    import http, base64, asyncio
+
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            request_line, *lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+            method, target, version = request_line.split(" ", 2)
+            headers = {}
+            for line in lines:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            path = urllib.parse.unquote(urllib.parse.urlsplit(target).path)
+
+            if headers.get("upgrade", "").lower() == "websocket":
+                # only the pages of this server (and clients that aren't browsers):
+                origin = headers.get("origin")
+                hosts = {headers.get("host"), f"{ARGS.host}:{ARGS.port}"}
+                if origin is not None and urllib.parse.urlsplit(origin).netloc not in hosts:
+                    writer.write(
+                        b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+                    )
+                    await writer.drain()
+                    return
+                key = headers.get("sec-websocket-key", "") + WEBSOCKET_GUID
+                accept = base64.b64encode(hashlib.sha1(key.encode()).digest()).decode()
+                writer.write(
+                    (
+                        "HTTP/1.1 101 Switching Protocols\r\n"
+                        "Upgrade: websocket\r\n"
+                        "Connection: Upgrade\r\n"
+                        f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+                    ).encode()
+                )
+                await serve_client(WebSocket(reader, writer), path)
+                return
+
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                    chunks.append((await reader.readexactly(size + 2))[:-2])
+                    if not size:
+                        break
+                body = b"".join(chunks)
+            else:
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            with span("http", sample=True, method=method, path=path):
+                try:
+                    status, response_headers, response = await track(
+                        handle_http_request(method, path, headers, body)
+                    )
+                except Exception as e:
+                    status, response_headers, response = 500, {}, f"{e}\n".encode()
+            keep_alive = version == "HTTP/1.1" and headers.get("connection") != "close"
+            response_headers = {
+                "Content-Type": "text/plain; charset=utf-8",
+                **response_headers,
+                "Content-Length": len(response),
+                "Connection": "keep-alive" if keep_alive else "close",
+            }
+            writer.write(
+                (
+                    f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\n"
+                    + "".join(f"{k}: {v}\r\n" for k, v in response_headers.items())
+                    + "\r\n"
+                ).encode("latin-1")
+                + (b"" if method == "HEAD" else response)
+            )
+            await writer.drain()
+            if not keep_alive:
+                return
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass  # client disconnected or sent an invalid request
+    finally:
+        writer.close()
+
+
+# shut down the smdv server
+async def shutdown(timeout: float = 10.0):
+    """ shut down the smdv server gracefully
+
+    Args:
+        timeout: the maximum time (in seconds) to wait for in-flight requests
+    """
+    import asyncio
+
+    close_server()
+    if PRERENDER_TASK is not None:
+        PRERENDER_TASK.cancel()
+    if FOLLOW_TASK is not None:
+        FOLLOW_TASK.cancel()
+    if UPGRADE["task"] is not None:
+        UPGRADE["task"].cancel()
+    pending = INFLIGHT - {asyncio.current_task()}
+    if pending:
+        await asyncio.wait(pending, timeout=timeout)
+    await asyncio.gather(
+        *[client.close(1012) for client in JSCLIENTS | PYCLIENTS], return_exceptions=True
+    )
+    # (only now: the drained requests may still render)
+    if RENDER_POOL is not None:
+        RENDER_POOL.shutdown(wait=False)
+    if RENDER_THREAD is not None:
+        RENDER_THREAD.shutdown(wait=False)
+    event_loop().stop()
+
+
+# stream the neovim buffer to the js clients
+async def stream_nvim_buffer():
+    """ render the lines of the neovim buffer (see --nvim-attach) until they stop changing
+
+    Line events arriving while the buffer is rendered are coalesced into a
+    single new render.
+    """
+    import asyncio
+
+    try:
+        while NVIM_BUFFER["dirty"]:
+            NVIM_BUFFER["dirty"] = False
+            await asyncio.sleep(0)  # apply the line events that arrived together
+            path = ARGS.home + MESSAGE.get("fileCwd", "") + MESSAGE.get("filename", "")
+            if path != NVIM_BUFFER["path"]:
+                return  # another file is shown in the meantime
+            message = dict(
+                MESSAGE,
+                func="file",
+                fileBody="\n".join(NVIM_BUFFER["lines"]),
+                fileOpen=True,
+                fileEncoding="",
+                fileEncoded=False,
+            )
+            await handle_message(None, message)
+    finally:
+        NVIM_BUFFER["task"] = None
+
+
+# unregister websocket client
+async def unregister_client(client: "WebSocket"):
+    """ unregister a client
+
+    Args:
+        client: the client (websocket) to unregister.
+
+    """
+    if client in JSCLIENTS:
+        JSCLIENTS.remove(client)
+    if client in PYCLIENTS:
+        PYCLIENTS.remove(client)
+
+
+# render the remaining sections of the shown file
+async def upgrade_sections():
+    """ render the pending sections of the shown file and send them to the js clients """
+    import asyncio
+
+    key, sections = UPGRADE["key"], UPGRADE["sections"]
+    for tier in ["fast", "full"] if UPGRADE["tier"] == "fast" else ["full"]:
+        for index in range(len(sections)):
+            await asyncio.sleep(0)  # allow requests for sections and cancellation
+            if sections[index][2] in {tier, "full"}:
+                continue
+            with timed("upgrade_sections", tier=tier):
+                html = await run_render(render_section, index, tier, key)
+            if html is None:
+                return  # another file is shown (and this task is cancelled)
+            update = json.dumps(
+                {"func": "section", "fileDegraded": key[0], "index": index, "fileBody": html}
+            )
+            await asyncio.gather(
+                *[client.send(update) for client in JSCLIENTS], return_exceptions=True
+            )
+    body = "\n".join(html for _, html, _ in sections)
+    if all(rendered == "full" for _, _, rendered in sections):  # (not shown as text)
+        await run_render(cache_put, key, ("md", body))
+    if MESSAGE.get("fileDegraded") == key[0]:
+        MESSAGE.update(fileBody=body, fileDegraded="")
+
+
+## Normal functions (alphabetic)
+
+# create the message showing the buffer of PUT and PATCH requests
+def buffer_message() -> dict:
+    """ create the message showing the buffer of PUT and PATCH requests
+
+    Returns:
+        message: dict: the message to send to the websocket server
+    """
+    cwd = os.path.abspath(os.path.expanduser(os.getcwd()))[len(ARGS.home) :] + "/"
+    return {
+        "func": "file",
+        "cwd": cwd,
+        "cwdBody": cached_dir2body(cwd),
+        "cwdEncoded": True,
+        "filename": "@put",
+        "fileBody": "\n".join(BUFFER["lines"]),
+        "fileCwd": cwd,
+        "fileOpen": True,
+        "fileEncoding": "md",
+        "fileEncoded": False,
+    }
+
+
+# get a rendered body from the render cache
+def cache_get(key: tuple):
+    """ get a rendered body from the render cache (in-memory, then on disk)
+
+    Args:
+        key: the cache key (content hash, encoding, static url)
+
+    Returns:
+        value: the cached (encoding, html) tuple or None when not cached
+    """
+    value = RENDER_CACHE.get(key)
+    if value is not None:
+        RENDER_CACHE.move_to_end(key)
+        count_metric("smdv_cache_requests_total", cache="render", result="hit")
+        return value
+    count_metric("smdv_cache_requests_total", cache="render", result="miss")
+    value = disk_cache_get(key)
+    if value is not None:
+        cache_put(key, value, persist=False)
+    return value
+
+
+# put a rendered body in the render cache
+def cache_put(key: tuple, value: tuple, persist: bool = True):
+    """ put a rendered body in the render cache (in-memory and on disk)
+
+    The least recently used entries are evicted when the total size of the
+    cache exceeds --render-cache-size.
+
+    Args:
+        key: the cache key (content hash, encoding, static url)
+        value: the (encoding, html) tuple to cache
+        persist: wether to also store the rendered body in the disk cache
+    """
+    global RENDER_CACHE_SIZE
+    if persist:
+        disk_cache_put(key, value)
+    if key in RENDER_CACHE:
+        RENDER_CACHE_SIZE -= len(RENDER_CACHE.pop(key)[1])
+    RENDER_CACHE[key] = value
+    RENDER_CACHE_SIZE += len(value[1])
+    while RENDER_CACHE and RENDER_CACHE_SIZE > ARGS.render_cache_size * 1e6:
+        RENDER_CACHE_SIZE -= len(RENDER_CACHE.popitem(last=False)[1][1])
+
+
+# convert a directory path to html, reusing the directory view shown
+def cached_dir2body(cwd: str) -> str:
+    """ convert a directory path to html (see dir2body), unless it is already shown
+
+    Args:
+        cwd: the directory path (relative to the smdv home)
+
+    Returns:
+        html: str: the directory view of the current message when it shows cwd
+            or else the newly rendered directory view.
+    """
+    if MESSAGE.get("cwd") == cwd and MESSAGE.get("cwdEncoded"):
+        return MESSAGE["cwdBody"]
+    return dir2body(cwd)
+
+
+# function to change the current working directory
+def change_current_working_directory(path: str) -> str:
+    """ change the current working directory
+
+    Args:
+        path: filename or directory name. If a filename is given,
+            the current directory will be changed to the containing
+            folder
+    """
+    fullpath = home_path(path)
     filename = ""
     dirpath = fullpath
     if not os.path.isdir(fullpath):
@@ -870,154 +2342,239 @@ def change_current_working_directory(path: str) -> str:
     return cwd, filename
 
 
-# flask app factory
-def create_app() -> flask.Flask:
-    """ flask app factory
+# convert markdown to html, telling whether it could be rendered
+def checked_md2body(content: str = "", static_url: str = None, tier: str = "full") -> tuple:
+    """ convert markdown to html (see md2body), telling whether it is shown as text
+
+    Args:
+        content: the markdown string to convert
+        static_url: the url to prefix relative links with (see md2body)
+        tier: the render tier (see markdown_interpreter)
 
     Returns:
-        app: the flask app
+        html: str: the resulting html
+        fallback: bool: whether the markdown could not be rendered and is shown
+            as text (see isolated_md2body), which should not be cached
+    """
+    with timed("md2body", tier=tier):
+        count_metric("smdv_render_tier_total", tier=tier)
+        parallel = tier == "full" and ARGS.render_workers > 1 and PARALLEL_MIN_SIZE < len(content)
+        # (small markdown renders faster than it is sent to the render pool):
+        if parallel or ARGS.render_timeout > 0 and ISOLATED_MIN_SIZE <= len(content):
+            html, fallback = isolated_md2body(content, tier, parallel)
+        else:
+            html, fallback = markdown_interpreter(tier)(content), False
+
+        if static_url is None:
+            static_url = get_static_url()
+        if not static_url:
+            return html, fallback
+
+        cwd = static_url.split("/@static", 1)[-1]
+        viewer_url = static_url.replace("/@static", "", 1)
+
+        def rewrite(match):
+            attribute, quote, url = match.groups()
+            if url.startswith(("/", "#")) or re.match("[a-zA-Z][a-zA-Z0-9+.-]*:", url):
+                return match.group(0)  # absolute urls and anchors
+            path = url.split("#")[0].split("?")[0]
+            if attribute == "href" and os.path.splitext(path)[1] in PRERENDER_EXTENSIONS:
+                # link to a document: open it in smdv (over the websocket)
+                url = f"{viewer_url}{url}{quote} data-smdv-open={quote}{cwd}{path}"
+                return f"{attribute}={quote}{url}{quote}"
+            return f"{attribute}={quote}{static_url}{url}{quote}"
+
+        html = re.sub("""(src|href)=(["'])(.*?)\\2""", rewrite, html)
+
+    return html, fallback
+
 
+# convert a chunk of markdown to html
+def chunk2body(chunk: str, tier: str = "full") -> tuple:
+    """ convert a chunk of markdown to html (in a worker of the render pool)
+
+    Args:
+        chunk: the chunk of markdown (see split_chunks), or a whole document
+        tier: the render tier (see markdown_interpreter)
+
+    Returns:
+        html: str: the resulting html, without relative links rewritten
+        counters: collections.Counter: the metrics counted while rendering
+            (to be added to the counters of the server process)
     """
+    counters = COUNTERS.copy()
+    html = markdown_interpreter(tier)(chunk)
+    return html, COUNTERS - counters
 
-    app = flask.Flask(__name__, static_folder=ARGS.home, static_url_path="/@static")
 
-    # stop the flask server
-    def stop_flask_server() -> int:
-        """ stop the flask server
+# stop accepting connections
+def close_server():
+    """ close the listening sockets of the smdv server
 
-        Returns:
-            exit_status: exit status of the request (0: success, 1: failure)
+    Connections that are already accepted are not affected. The control socket
+    is removed immediately, such that a new smdv server can take its place.
+    """
+    global CONTROL_SERVER
+    for server in SERVERS:
+        server.close()
+    if CONTROL_SERVER is not None:
+        CONTROL_SERVER.close()
+        CONTROL_SERVER = None
+        # don't remove the control socket of a new server that took over:
+        with contextlib.suppress(OSError):
+            if os.stat(ARGS.control_socket).st_ino == CONTROL_SOCKET_INODE:
+                os.remove(ARGS.control_socket)
+
+
+# send a request over the control socket
+def control_request(command: str, **kwargs) -> dict:
+    """ send a request to the smdv server over its unix domain control socket
 
-        """
-        func = flask.request.environ.get("werkzeug.server.shutdown")
-        try:
-            func()
-            return 0
-        except Exception as e:
-            return 1
+    Args:
+        command: the command to execute (see `handle_control_request`)
+        **kwargs: the arguments of the command
 
-    # index route for the smdv app
-    @app.route("/", methods=["GET", "PUT", "DELETE"])
-    @app.route("/<path:path>/", methods=["GET"])
-    def index(path: str = "") -> str:
-        """ the main (index) route of smdv
+    Returns:
+        response: dict: the response of the smdv server
 
-        Returns:
-            html: the html representation of the requested path
-        """
-        if flask.request.method == "GET":
-            try:
-                cwd, filename = change_current_working_directory(path)
-            except FileNotFoundError:
-                return flask.abort(404)
+    Raises:
+        OSError: when the control socket is disabled or unreachable.
+    """
+    if not ARGS.control_socket:
+        raise FileNotFoundError("the control socket is disabled")
+    request = json.dumps({"cmd": command, **kwargs}).encode()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(10.0 + kwargs.get("timeout", 0))
+        sock.connect(ARGS.control_socket)
+        sock.sendall(struct.pack("!I", len(request)) + request)
+        with sock.makefile("rb") as file:
+            (length,) = struct.unpack("!I", file.read(4))
+            response = json.loads(file.read(length))
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error", "control request failed"))
+    return response
+
+
+# increment a counter metric
+def count_metric(name: str, value: float = 1, **labels):
+    """ increment a counter metric
 
-            html = HTMLTEMPLATE.format(
-                home=ARGS.home,
-                interactive=f"{'--interactive' if ARGS.interactive else ''}",
-                md_css_cdn=ARGS.md_css_cdn,
-                host=ARGS.websocket_host,
-                port=ARGS.websocket_port,
-            )
-            if filename:
-                if is_binary_file(filename):
-                    return flask.redirect(flask.url_for("static", filename=path))
-                with open(filename, "r") as file:
-                    send_as_pyclient(
-                        {
-                            "func": "file",
-                            "cwd": cwd,
-                            "cwdBody": dir2body(cwd),
-                            "cwdEncoded": True,
-                            "filename": filename,
-                            "fileBody": file.read(),
-                            "fileCwd": cwd,
-                            "fileOpen": True,
-                            "fileEncoding": "",
-                            "fileEncoded": False,
-                        }
-                    )
-                    return html
-            # this only happens if requested path is a directory
-            send_as_pyclient(
-                {
-                    "func": "dir",
-                    "cwd": cwd,
-                    "cwdBody": dir2body(cwd),
-                    "cwdEncoded": True,
-                    "filename": filename,
-                    "fileBody": "",
-                    "fileCwd": cwd,
-                    "fileOpen": False,
-                    "fileEncoding": "",
-                    "fileEncoded": False,
-                }
-            )
-            return html
+    Args:
+        name: the name of the counter (should be defined in METRICS)
+        value: the value to increment the counter with
+        **labels: the labels of the counter
+    """
+    COUNTERS[name, tuple(sorted(labels.items()))] += value
 
-        if flask.request.method == "PUT":
-            cwd = (
-                os.path.abspath(os.path.expanduser(os.getcwd()))[len(ARGS.home) :] + "/"
-            )
-            send_as_pyclient(
-                {
-                    "func": "file",
-                    "cwd": cwd,
-                    "cwdBody": dir2body(cwd),
-                    "cwdEncoded": True,
-                    "filename": "@put",
-                    "fileBody": flask.request.data.decode(),
-                    "fileCwd": cwd,
-                    "fileOpen": True,
-                    "fileEncoding": "md",
-                    "fileEncoded": False,
-                }
-            )
-            return ""
 
-        if flask.request.method == "DELETE":
-            exit_status = stop_flask_server()
-            return "failed.\n" if exit_status else "success.\n"
+# render the first sections of markdown
+def degraded_md2body(key: tuple, sections: list, static_url: str, tier: str) -> str:
+    """ render the first sections of markdown, to be completed in the background
 
-        # should never get here:
-        return "failed.\n"
+    The other sections are sent as placeholders (see upgrade_sections).
 
-    return app
+    Args:
+        key: the render cache key of the full render (see encode)
+        sections: the markdown sections (see split_sections)
+        static_url: the url to prefix relative links with (see md2body)
+        tier: the render tier of the file (see render_tier)
+
+    Returns:
+        html: str: the resulting html
+    """
+    import html
+    from markdown.extensions.toc import slugify
+
+    UPGRADE.update(key=key, sections=[], static_url=static_url, tier=tier)
+    bodies, size = [], 0
+    for index, section in enumerate(sections):
+        body = ""
+        if len(sections) > 1:
+            digest = hashlib.sha256(section.encode(errors="replace")).hexdigest()
+            cached = cache_get((digest, "md", static_url))
+            body = cached[1] if cached is not None else ""
+        UPGRADE["sections"].append([section, body, "full" if body else ""])
+        if not body and (index == 0 or size < STREAM_FIRST_SIZE):
+            body = render_section(index, tier, key)
+            size += len(section)
+        if body:
+            bodies.append(f'<div class="smdv-section" data-smdv-section="{index}">{body}</div>')
+            continue
+        heading = re.match(r" {0,3}(#{1,6})\s+(.*?)[\s#]*$", section.split("\n", 1)[0])
+        if heading:
+            level, title = len(heading.group(1)), re.sub(r"[*_`]", "", heading.group(2))
+            body = f'<h{level} id="{slugify(title, "-")}">{html.escape(title)}</h{level}>'
+        height = 1.5 * section.count("\n")  # in em (roughly the height of the render)
+        bodies.append(
+            f'<div class="smdv-section" data-smdv-section="{index}" data-smdv-pending="true" '
+            f'style="min-height: {height:.0f}em">{body}</div>'
+        )
+    return "\n".join(bodies)
 
 
 # encode a string in the given encoding format
-def encode(message: dict) -> dict:
-    """ encode the body of a message. """
+def encode(message: dict, static_url: str = None, degrade: bool = False) -> dict:
+    """ encode the body of a message.
+
+    Args:
+        message: the message to encode the body for
+        static_url: the url to prefix relative links with (see md2body)
+        degrade: render only the first sections of large markdown (in the
+            fast tier for oversized markdown, see degraded_md2body). The
+            message then gets the digest of the content as fileDegraded.
+
+    Returns:
+        message: the message with encoded body
+    """
+    digest = message.pop("fileDigest", None)  # the hash of the raw file (see read_file)
     if message.get("fileEncoded", False):
         return message  # don't encode again if the message is already encoded
     message["fileEncoded"] = True
-    encoding = message.get("fileEncoding")
-    filename = message.get("filename")
-    if not encoding:
-        if filename[0] == "." and not "." in filename[1:]:
-            encoding = "txt"
-        else:
-            encoding = os.path.splitext(message.get("filename"))[1][1:]
-            if not encoding:
-                encoding = ARGS.stdin
-        message["fileEncoding"] = encoding
-    if encoding == "md":
-        message["fileBody"] = md2body(message["fileBody"])
-        return message
-    if encoding == "ipynb":
-        try:
-            message["fileBody"] = ipynb2body(message["fileBody"])
-            return message
-        except ImportError:
-            encoding = message["fileEncoding"] = "txt"
-    if encoding == "txt":
-        message["fileBody"] = txt2body(message["fileBody"])
+    message["fileDegraded"] = ""
+    encoding = message.get("fileEncoding") or filename_encoding(message.get("filename"))
+    if encoding not in {"md", "ipynb", "txt", "html"}:
+        encoding = "txt"
+    message["fileEncoding"] = encoding
+    observe_metric("smdv_payload_size_bytes", len(message["fileBody"]), direction="in")
+    if encoding == "html":
         return message
-    if message["fileEncoding"] == "html":
+    if static_url is None:
+        static_url = get_static_url()
+    if digest is None:
+        digest = hashlib.sha256(message["fileBody"].encode(errors="replace")).hexdigest()
+    key = (digest, encoding, static_url)
+    cached = cache_get(key)
+    if cached is not None:
+        message["fileEncoding"], message["fileBody"] = cached
         return message
-
-    message["fileEncoding"] = "txt"
-    message["fileEncoded"] = False
-    return encode(message)
+    fallback = False  # markdown shown as text is not cached
+    with timed("encode", encoding=encoding) as labels:
+        if encoding == "ipynb":
+            try:
+                message["fileBody"] = ipynb2body(message["fileBody"])
+            except (ImportError, ValueError):  # no nbconvert or a truncated notebook
+                encoding = message["fileEncoding"] = labels["encoding"] = "txt"
+        if encoding == "md":
+            sections = split_sections(message["fileBody"])
+            tier = labels["tier"] = render_tier(message["fileBody"]) if degrade else "full"
+            streamed = len(sections) > 1 and STREAM_MIN_SIZE < len(message["fileBody"])
+            if degrade and (tier == "fast" or streamed):
+                message["fileBody"] = degraded_md2body(key, sections, static_url, tier)
+                message["fileDegraded"] = digest
+                return message  # the full render is cached once all sections are rendered
+            if len(sections) > 1:  # only the sections that changed are rendered
+                bodies = [section2body(section, static_url) for section in sections]
+                message["fileBody"] = "\n".join(html for html, _ in bodies)
+                fallback = any(fallback for _, fallback in bodies)
+            else:
+                message["fileBody"], fallback = checked_md2body(message["fileBody"], static_url)
+        if encoding == "txt":  # rendered as a markdown code block (see txt2body)
+            with timed("txt2body"):
+                content = f"```\n{message['fileBody']}\n```"
+                message["fileBody"], fallback = checked_md2body(content, static_url)
+    if not fallback:
+        cache_put(key, (message["fileEncoding"], message["fileBody"]))
+    return message
 
 
 # convert a directory path to a markdown representation of the directory view
@@ -1030,25 +2587,149 @@ def dir2body(cwd: str) -> str:
     Returns:
         html: str: the resulting html
     """
-    i = 1 if (cwd and cwd[0] == "/") else 0
-    path = os.path.join(ARGS.home, cwd[i:])
-    paths = sorted([p for p in os.listdir(path)], key=str.upper)
-    paths = [os.path.join(path, p) for p in paths]
-    url = lambda path: path.replace(ARGS.home, f"http://127.0.0.1:{ARGS.port}")
-    link = lambda i, t, p: (f"{t}{i}&nbsp;{os.path.basename(p)}{t[0]}/{t[1:]}", url(p))
-    dirlinks = [link("📁", "<b>", p) for p in paths if os.path.isdir(p)]
-    filelinks = [link("📄", " ", p) for p in paths if not os.path.isdir(p)]
-    dirhtml = [f'<a href="{url}">{name}</a>' for name, url in dirlinks]
-    filehtml = [
-        f'<a href="{url}">{name.replace("/","")}</a>' for name, url in filelinks
-    ]
-    html = "<br>\n".join(dirhtml + filehtml)
+    with timed("dir2body"):
+        path = home_path(cwd)
+        paths = sorted([p for p in os.listdir(path)], key=str.upper)
+        paths = [os.path.join(path, p) for p in paths]
+        url = lambda path: path.replace(ARGS.home, f"http://127.0.0.1:{ARGS.port}")
+        link = lambda i, t, p: (f"{t}{i}&nbsp;{os.path.basename(p)}{t[0]}/{t[1:]}", url(p))
+        dirlinks = [link("📁", "<b>", p) for p in paths if os.path.isdir(p)]
+        filelinks = [link("📄", " ", p) for p in paths if not os.path.isdir(p)]
+        dirhtml = [f'<a href="{url}">{name}</a>' for name, url in dirlinks]
+        filehtml = [
+            f'<a href="{url}">{name.replace("/","")}</a>' for name, url in filelinks
+        ]
+        html = "<br>\n".join(dirhtml + filehtml)
     return html
 
 
+# open the persistent render cache
+def disk_cache() -> "sqlite3.Connection":
+    """ open (or get the already opened) persistent render cache
+
+    The cache is an sqlite database in --cache-dir, shared by all smdv processes.
+
+    Returns:
+        connection: the database connection (None if the disk cache is disabled)
+    """
+    import sqlite3
+
+    global DISK_CACHE
+    if DISK_CACHE is None and ARGS.disk_cache_size > 0:
+        os.makedirs(ARGS.cache_dir, exist_ok=True)
+        DISK_CACHE = sqlite3.connect(
+            os.path.join(ARGS.cache_dir, "render-cache.sqlite3"),
+            timeout=1.0,
+            isolation_level=None,  # autocommit
+            check_same_thread=False,
+        )
+        DISK_CACHE.execute("PRAGMA journal_mode=WAL")
+        DISK_CACHE.execute(
+            "CREATE TABLE IF NOT EXISTS renders (key TEXT PRIMARY KEY, "
+            "encoding TEXT, html TEXT, size INTEGER, accessed REAL)"
+        )
+        DISK_CACHE.execute("CREATE INDEX IF NOT EXISTS lru ON renders (accessed)")
+        DISK_CACHE.execute(
+            "CREATE TABLE IF NOT EXISTS failures (key TEXT PRIMARY KEY, reason TEXT, failed REAL)"
+        )
+    return DISK_CACHE
+
+
+# get a rendered body from the persistent render cache
+def disk_cache_get(key: tuple):
+    """ get a rendered body from the persistent render cache
+
+    Args:
+        key: the cache key (content hash, encoding, static url)
+
+    Returns:
+        value: the cached (encoding, html) tuple or None when not cached
+    """
+    import sqlite3
+
+    try:
+        connection = disk_cache()
+        if connection is None:
+            return None
+        key = disk_cache_key(key)
+        row = connection.execute(
+            "SELECT encoding, html FROM renders WHERE key=?", (key,)
+        ).fetchone()
+        if row is not None:
+            connection.execute(
+                "UPDATE renders SET accessed=? WHERE key=?", (time.time(), key)
+            )
+    except sqlite3.Error:
+        return None  # the disk cache should never break rendering
+    result = "miss" if row is None else "hit"
+    count_metric("smdv_cache_requests_total", cache="disk", result=result)
+    return row if row is None else tuple(row)
+
+
+# get the key of a rendered body in the persistent render cache
+def disk_cache_key(key: tuple) -> str:
+    """ convert a render cache key to a persistent render cache key
+
+    As opposed to the in-memory cache, the persistent cache outlives smdv
+    upgrades, hence the renderer version is made part of the key.
+
+    Args:
+        key: the cache key (content hash, encoding, static url)
+
+    Returns:
+        key: str: the persistent cache key
+    """
+    return hashlib.sha256(repr((key, renderer_version())).encode()).hexdigest()
+
+
+# put a rendered body in the persistent render cache
+def disk_cache_put(key: tuple, value: tuple):
+    """ put a rendered body in the persistent render cache
+
+    The least recently used entries are evicted when the total size of the
+    cache exceeds --disk-cache-size.
+
+    Args:
+        key: the cache key (content hash, encoding, static url)
+        value: the (encoding, html) tuple to cache
+    """
+    import sqlite3
+
+    global DISK_CACHE_WRITES
+    try:
+        connection = disk_cache()
+        if connection is None:
+            return
+        connection.execute(
+            "INSERT OR REPLACE INTO renders VALUES (?, ?, ?, ?, ?)",
+            (disk_cache_key(key), value[0], value[1], len(value[1]), time.time()),
+        )
+        DISK_CACHE_WRITES += 1
+        if DISK_CACHE_WRITES % 20 != 1:
+            return  # only check the cache size every now and then
+        size, rows = connection.execute("SELECT SUM(size), COUNT(*) FROM renders").fetchone()
+        while size and size > ARGS.disk_cache_size * 1e6:
+            connection.execute(
+                "DELETE FROM renders WHERE key IN "
+                "(SELECT key FROM renders ORDER BY accessed LIMIT ?)",
+                (max(1, rows // 10),),
+            )
+            size, rows = connection.execute(
+                "SELECT SUM(size), COUNT(*) FROM renders"
+            ).fetchone()
+    except sqlite3.Error:
+        pass  # the disk cache should never break rendering
+
+
 # open file in neovim
 def edit_in_neovim(filename: str = ""):
-    """ Open file in neovim using neovim-remote
+    """ Open file in neovim
+
+    The file is opened with an :edit command over the persistent pynvim session
+    to the neovim server at --nvim-address (see nvim_session). When pynvim is
+    not installed, neovim-remote is used instead. When no neovim is reachable,
+    a new neovim listening at --nvim-address (or else $EDITOR) is started in a
+    terminal.
 
     Args:
         filename: str="": the filename to open in neovim
@@ -1061,10 +2742,511 @@ def edit_in_neovim(filename: str = ""):
         dirname = os.path.dirname(sock)
         if not os.path.exists(dirname):
             os.makedirs(dirname)
-    if socket_in_use(sock):
-        subprocess.Popen(["nvr", "-s", "--nostart", "--servername", sock, path])
+
+    def edit():  # connecting to neovim may block: don't block the event loop
+        try:
+            if nvim_call(sock, lambda nvim: nvim.command(f"edit {nvim.funcs.fnameescape(path)}")):
+                return
+        except ImportError:  # no pynvim: use neovim-remote
+            if socket_in_use(sock) and shutil.which("nvr"):
+                subprocess.Popen(["nvr", "-s", "--nostart", "--servername", sock, path])
+                return
+        if shutil.which("nvr"):
+            command = ["nvr", "-s", "--servername", sock, path]
+        elif shutil.which("nvim"):
+            command = ["nvim", "--listen", sock, path]
+        elif os.environ.get("EDITOR"):
+            import shlex
+
+            command = [*shlex.split(os.environ["EDITOR"]), path]
+        else:
+            warnings.warn(f"can't edit {path}: neither neovim nor $EDITOR is available")
+            return
+        try:
+            subprocess.Popen([ARGS.terminal, "-e", *command])
+        except OSError as e:
+            warnings.warn(f"can't edit {path} in the terminal {ARGS.terminal!r}: {e}")
+
+    threading.Thread(target=edit, daemon=True).start()
+
+
+# get the event loop
+def event_loop() -> "asyncio.AbstractEventLoop":
+    """ get the asyncio event loop (which is created on first use)
+
+    Returns:
+        loop: asyncio.AbstractEventLoop: the event loop of this smdv process
+    """
+    import asyncio
+
+    global EVENT_LOOP
+    if EVENT_LOOP is None:
+        EVENT_LOOP = asyncio.new_event_loop()
+        asyncio.set_event_loop(EVENT_LOOP)
+    return EVENT_LOOP
+
+
+# export a directory tree as static html site
+def export(src: str, dest: str) -> dict:
+    """ export a directory tree as a static html site
+
+    Unchanged files (see EXPORT_MANIFEST) are skipped, failed files are retried next time.
+
+    Args:
+        src: the directory to export
+        dest: the destination directory for the static site
+
+    Returns:
+        stats: dict: the number of rendered, copied, unchanged, removed and
+            failed files, and the error per failed file (in "failures")
+    """
+    import concurrent.futures
+
+    start = time.perf_counter()
+    src, dest = os.path.abspath(src), os.path.abspath(dest)
+    if not os.path.isdir(src):
+        raise FileNotFoundError(f"Could not find directory {src}")
+    os.makedirs(dest, exist_ok=True)
+
+    config = (renderer_version(), EXPORTTEMPLATE)
+    config = hashlib.sha256(repr(config).encode()).hexdigest()
+    manifest = {"config": "", "files": {}, "dirs": {}}
+    try:
+        with open(os.path.join(dest, EXPORT_MANIFEST), "r") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        pass
+    if manifest["config"] != config:
+        manifest = {"config": config, "files": {}, "dirs": {}}
+
+    files, dirs, jobs, failures = {}, {}, [], {}
+    stats = {"rendered": 0, "copied": 0, "unchanged": 0, "removed": 0, "failed": 0}
+    for root, dirnames, filenames in os.walk(src):
+        dirnames[:] = [
+            d for d in sorted(dirnames, key=str.upper)
+            if not d.startswith(".") and os.path.join(root, d) != dest
+        ]
+        filenames = [f for f in sorted(filenames, key=str.upper) if not f.startswith(".")]
+        reldir = os.path.relpath(root, src)
+        listing = hashlib.sha256(repr((dirnames, filenames)).encode()).hexdigest()
+        dirs[reldir] = listing
+        if manifest["dirs"].get(reldir) != listing:
+            os.makedirs(os.path.join(dest, reldir), exist_ok=True)
+            export_index(os.path.join(dest, reldir), reldir, dirnames, filenames)
+        for filename in filenames:
+            relpath = os.path.normpath(os.path.join(reldir, filename))
+            entry = manifest["files"].get(relpath, {})
+            files[relpath] = entry
+            rendered = os.path.splitext(filename)[1][1:] in EXPORT_ENCODINGS
+            exists = os.path.exists(os.path.join(dest, relpath + (".html" if rendered else "")))
+            try:
+                stat = os.stat(os.path.join(src, relpath))
+                if (
+                    exists
+                    and entry.get("size") == stat.st_size
+                    and entry.get("mtime") == stat.st_mtime_ns
+                ):
+                    stats["unchanged"] += 1
+                    continue
+                with open(os.path.join(src, relpath), "rb") as file:
+                    digest = hashlib.sha256(file.read()).hexdigest()
+                files[relpath] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest}
+                if exists and entry.get("hash") == digest:
+                    stats["unchanged"] += 1
+                    continue
+                shutil.copy2(os.path.join(src, relpath), os.path.join(dest, relpath))
+            except OSError as e:
+                failures[relpath] = str(e)
+                continue
+            if rendered:
+                jobs.append((os.path.join(src, relpath), os.path.join(dest, relpath)))
+            else:
+                stats["copied"] += 1
+
+    if len(jobs) > 1:
+        workers = min(os.cpu_count() or 1, len(jobs))
+        with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=initialize_worker, initargs=(ARGS,)
+        ) as executor:
+            chunksize = max(1, len(jobs) // (4 * workers))
+            errors = list(executor.map(export_file, jobs, chunksize=chunksize))
     else:
-        subprocess.Popen([ARGS.terminal, "-e", "nvr", "-s", "--servername", sock, path])
+        errors = [export_file(job) for job in jobs]
+    for (path, _), error in zip(jobs, errors):
+        if error:
+            failures[os.path.relpath(path, src)] = error
+        else:
+            stats["rendered"] += 1
+    for relpath in failures:
+        files.pop(relpath)  # (such that the file is exported again next time)
+
+    for relpath in set(manifest["files"]) - set(files) - set(failures):
+        for path in (relpath, relpath + ".html"):
+            if os.path.exists(os.path.join(dest, path)):
+                os.remove(os.path.join(dest, path))
+        stats["removed"] += 1
+
+    manifest = {"config": config, "files": files, "dirs": dirs, "failures": failures}
+    with open(os.path.join(dest, EXPORT_MANIFEST + ".tmp"), "w") as file:
+        json.dump(manifest, file)
+    os.replace(os.path.join(dest, EXPORT_MANIFEST + ".tmp"), os.path.join(dest, EXPORT_MANIFEST))
+    stats.update(failed=len(failures), failures=failures, seconds=time.perf_counter() - start)
+    return stats
+
+
+# export a single file as static html page
+def export_file(job: tuple) -> str:
+    """ render a single file to a static html page (used by `export`)
+
+    Args:
+        job: tuple of the source filename and the destination filename (the
+            page is written to the destination filename + '.html')
+
+    Returns:
+        error: str: why the file could not be exported ("" when it was exported)
+    """
+    src, dest = job
+    try:
+        content, digest = read_file(src, filename_encoding(src))
+        message = {"filename": os.path.basename(src), "fileBody": content, "fileDigest": digest}
+        body = encode(message, static_url="")["fileBody"]
+    except Exception as e:  # (a broken file should not stop the export)
+        return f"{type(e).__name__}: {e}"
+
+    # links to other rendered files should point to their html page:
+    extensions = "|".join(EXPORT_ENCODINGS)
+    body = re.sub(
+        rf'href="((?:[^":#?/]+/)*[^":#?/]+\.(?:{extensions}))(#[^"]*)?"', r'href="\1.html\2"', body
+    )
+    navbar = (
+        f'<a href="index.html">📁</a>&nbsp;{os.path.basename(src)}&nbsp;'
+        f'<a href="{os.path.basename(src)}">[{message["fileEncoding"]}]</a>'
+    )
+    try:
+        with open(dest + ".html", "w") as file:
+            file.write(
+                EXPORTTEMPLATE.format(
+                    interactive=os.path.basename(src),
+                    md_css_cdn=ARGS.md_css_cdn,
+                    navbar=navbar,
+                    body=body,
+                )
+            )
+    except OSError as e:
+        return f"{type(e).__name__}: {e}"
+    return ""
+
+
+# write the index page of a directory for the static html export
+def export_index(path: str, reldir: str, dirnames: list, filenames: list) -> str:
+    """ write a `dir2body`-like index.html page for an exported directory
+
+    Args:
+        path: the exported directory to write the index.html to
+        reldir: the path of the directory relative to the export root
+        dirnames: the subdirectories to link to
+        filenames: the files to link to
+
+    Returns:
+        filename: the filename of the written index.html page
+    """
+    link = lambda url, name: f'<a href="{url}">{name}</a>'
+    rendered = lambda f: os.path.splitext(f)[1][1:] in EXPORT_ENCODINGS
+    dirhtml = [link(f"{d}/index.html", f"<b>📁&nbsp;{d}</b>") for d in dirnames]
+    filehtml = [link(f + ".html" if rendered(f) else f, f"📄&nbsp;{f}") for f in filenames]
+    reldir = "/" if reldir == "." else f"/{reldir}/"
+    navbar = link("../index.html", "⬆") + f"&nbsp;📁&nbsp;{reldir}" if reldir != "/" else "📁&nbsp;/"
+    with open(os.path.join(path, "index.html"), "w") as file:
+        file.write(
+            EXPORTTEMPLATE.format(
+                interactive=reldir,
+                md_css_cdn=ARGS.md_css_cdn,
+                navbar=navbar,
+                body="<br>\n".join(dirhtml + filehtml),
+            )
+        )
+    return os.path.join(path, "index.html")
+
+
+# get the reason a render failed
+def failure_get(key: tuple):
+    """ get the reason the render of markdown failed (in memory, then on disk)
+
+    Args:
+        key: the failure key (content hash, render tier, --render-timeout and
+            --render-memory), such that larger budgets render the markdown again
+
+    Returns:
+        reason: str: the reason the render failed or None when it did not fail
+    """
+    import sqlite3
+
+    reason = RENDER_FAILURES.get(key)
+    if reason is not None:
+        return reason
+    try:
+        connection = disk_cache()
+        if connection is None:
+            return None
+        row = connection.execute(
+            "SELECT reason FROM failures WHERE key=?", (disk_cache_key(key),)
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is not None:
+        reason = RENDER_FAILURES[key] = row[0]
+    return reason
+
+
+# record that a render failed
+def failure_put(key: tuple, reason: str):
+    """ record that the render of markdown failed, such that it is not retried
+
+    Args:
+        key: the failure key (see failure_get)
+        reason: the reason the render failed (timeout, memory or recursion)
+    """
+    import sqlite3
+
+    RENDER_FAILURES[key] = reason
+    try:
+        connection = disk_cache()
+        if connection is not None:
+            connection.execute(
+                "INSERT OR REPLACE INTO failures VALUES (?, ?, ?)",
+                (disk_cache_key(key), reason, time.time()),
+            )
+    except sqlite3.Error:
+        pass  # the disk cache should never break rendering
+
+
+# show markdown that could not be rendered as text
+def fallback2body(content: str, reason: str) -> str:
+    """ show markdown that could not be rendered as (escaped) text
+
+    Args:
+        content: the markdown that could not be rendered
+        reason: the reason the render failed (see isolated_md2body)
+
+    Returns:
+        html: str: the resulting html
+    """
+    import html
+
+    return (
+        f"<p>[smdv: this markdown could not be rendered ({reason}) and is shown as text, "
+        f"see --render-timeout and --render-memory]</p>\n<pre>{html.escape(content)}</pre>"
+    )
+
+
+# create a message to open a file
+def file_message(path: str) -> dict:
+    """ read a file and create the message to open it in smdv
+
+    Args:
+        path: the path of the file (relative to the smdv home)
+
+    Returns:
+        message: dict: the message to send to the websocket server
+    """
+    cwd, filename = change_current_working_directory(path)
+    encoding = file_type(filename)
+    if encoding == "binary":
+        raise UnicodeDecodeError("utf-8", b"", 0, 0, f"{filename} is a binary file")
+    digest = None
+    if encoding in {"csv", "tsv"}:  # only the first rows of tables are read
+        content = table2body(os.path.abspath(filename))
+    else:
+        content, digest = read_file(filename, encoding)
+    message = {
+        "func": "file",
+        "cwd": cwd,
+        "cwdBody": dir2body(cwd),
+        "cwdEncoded": True,
+        "filename": filename,
+        "fileBody": content,
+        "fileCwd": cwd,
+        "fileOpen": True,
+        "fileEncoding": encoding,
+        "fileEncoded": digest is None,
+    }
+    if digest is not None:
+        message["fileDigest"] = digest
+    return message
+
+
+# get the type of a file
+def file_type(filename: str) -> str:
+    """ get the type of a file: "binary" or the encoding to show it with
+
+    Args:
+        filename: the filename of the file
+
+    Returns:
+        type: str: "binary" or the encoding (md, ipynb, txt, html, csv or tsv)
+
+    Raises:
+        OSError: when the file can't be read
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if key in FILE_TYPES:
+        FILE_TYPES.move_to_end(key)
+        return FILE_TYPES[key]
+    with open(filename, "rb") as file:
+        block = file.read(1024)
+    if block.translate(None, TEXT_CHARACTERS):
+        FILE_TYPES[key] = "binary"
+    else:
+        extension = os.path.splitext(filename)[1].lower()
+        FILE_TYPES[key] = extension[1:] if extension in TABLE_EXTENSIONS else filename_encoding(filename)
+    while len(FILE_TYPES) > FILE_TYPES_MAX:
+        FILE_TYPES.popitem(last=False)
+    return FILE_TYPES[key]
+
+
+# get the encoding of a file from its filename
+def filename_encoding(filename: str) -> str:
+    """ get the encoding to render a file with from its filename
+
+    Args:
+        filename: the filename
+
+    Returns:
+        encoding: str: md, ipynb, txt or html
+    """
+    filename = os.path.basename(filename)
+    if filename[0] == "." and not "." in filename[1:]:
+        encoding = "txt"
+    else:
+        encoding = os.path.splitext(filename)[1][1:]
+        if not encoding:
+            encoding = ARGS.stdin
+    if encoding not in {"md", "ipynb", "txt", "html"}:
+        encoding = "txt"
+    return encoding
+
+
+# join the body of the followed file
+def follow_body():
+    """ update the body of the followed file in MESSAGE from its fragments (see follow) """
+    if (
+        FOLLOW.get("stale")
+        and MESSAGE.get("filename") == FOLLOW["filename"]
+        and MESSAGE.get("fileCwd") == FOLLOW["cwd"]
+    ):
+        MESSAGE["fileBody"] = FOLLOW["opening"] + "".join(FOLLOW["fragments"]) + FOLLOW["closing"]
+    if FOLLOW:
+        FOLLOW["stale"] = False
+
+
+# render the data appended to a followed file
+def follow_render(data: bytes, final: bool = False) -> list:
+    """ render the data appended to the followed file (see follow)
+
+    Only complete lines (for md: complete blocks, outside of fenced code) are
+    rendered, the rest of the data is kept until more data is appended.
+
+    Args:
+        data: the data appended to the followed file
+        final: whether the file stopped growing (render everything)
+
+    Returns:
+        fragments: list: the html fragments to append to the shown file (one
+            per line for txt, one per chunk of blocks otherwise)
+    """
+    import html
+
+    data = FOLLOW["pending"] + data
+    if final:
+        cut = len(data)
+    elif FOLLOW["encoding"] == "md":
+        cut, position, fence = 0, 0, b""
+        for line in data.split(b"\n")[:-1]:  # complete lines only
+            position += len(line) + 1
+            match = re.match(rb" {0,3}(`{3,}|~{3,})", line)
+            if fence:
+                if match and match.group(1)[:1] == fence[:1] and len(match.group(1)) >= len(fence):
+                    fence = b""
+            elif match:
+                fence = match.group(1)
+            elif not line.strip():
+                cut = position  # a blank line outside of fenced code ends a block
+        if not cut and len(data) > 8 * FOLLOW_CHUNK_SIZE:
+            cut = data.rfind(b"\n") + 1  # don't wait forever for a block to end
+    else:
+        cut = data.rfind(b"\n") + 1
+    FOLLOW["pending"] = data[cut:]
+    text = data[:cut].decode(errors="replace")
+    if not text:
+        return []
+    if FOLLOW["encoding"] == "md":
+        return [f"<div>{md2body(text)}</div>"]
+    if FOLLOW["encoding"] == "html":
+        return [f"<div>{text}</div>"]
+    lines = text[:-1].split("\n") if text.endswith("\n") else text.split("\n")
+    return [f"<span>{html.escape(line)}\n</span>" for line in lines]
+
+
+# get the static url of a directory
+def get_static_url(cwd: str = None) -> str:
+    """ get the url of a directory on the static route of the smdv server
+
+    Args:
+        cwd: the directory (relative to the smdv home). Defaults to the current
+            working directory.
+
+    Returns:
+        url: str: the static url of the directory (ending with a slash)
+    """
+    if cwd is None:
+        cwd = os.path.abspath(os.getcwd()).replace(ARGS.home, "") + "/"
+    return f"http://{ARGS.host}:{ARGS.port}/@static{cwd}"
+
+
+# get the absolute path of a path relative to the smdv home
+def home_path(path: str) -> str:
+    """ get the absolute path of a path relative to the smdv home
+
+    Args:
+        path: the path (relative to the smdv home, with or without leading slash)
+
+    Returns:
+        fullpath: str: the absolute (but unresolved) path
+
+    Raises:
+        FileNotFoundError: when the path resolves to outside of the smdv home
+    """
+    fullpath = os.path.join(ARGS.home, path.lstrip("/"))
+    home, realpath = os.path.realpath(ARGS.home), os.path.realpath(fullpath)
+    if realpath != home and not realpath.startswith(home + os.sep):
+        raise FileNotFoundError(f"Could not find {path} in the smdv home")
+    return fullpath
+
+
+# initialize a worker process
+def initialize_worker(args: argparse.Namespace, pids: "multiprocessing.SimpleQueue" = None):
+    """ initialize a worker process of a process pool
+
+    The address space of the worker is limited to --render-memory, such that
+    renders running out of it raise a MemoryError in the worker.
+
+    Args:
+        args: the smdv command line arguments of the parent process (the
+            worker renders in its own process, without a render pool)
+        pids: the queue to report the pid of the worker on (see kill_render_pool)
+    """
+    import resource
+
+    global ARGS
+    ARGS = argparse.Namespace(**{**vars(args), "render_workers": 1, "render_timeout": 0})
+    if pids is not None:
+        pids.put(os.getpid())
+    if ARGS.render_memory > 0:
+        limit, hard = int(ARGS.render_memory * 1e6), resource.getrlimit(resource.RLIMIT_AS)[1]
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
 
 
 # convert a jupyter notebook to html
@@ -1086,22 +3268,23 @@ def ipynb2body(content: str) -> str:
     from nbconvert.nbconvertapp import NbConvertApp
     from nbconvert.exporters.html import HTMLExporter
 
-    # create an NbConvertApp:
-    app = NbConvertApp.instance()
-    # initialize the app with the arguments
-    app.initialize(["--template=basic"])
-    # create an exporter
-    app.exporter = HTMLExporter(config=app.config)
-    # get html output
-    html, _ = app.export_single_notebook(
-        notebook_filename=None, resources=None, input_buffer=io.StringIO(content)
-    )
+    with timed("ipynb2body"):
+        # create an NbConvertApp:
+        app = NbConvertApp.instance()
+        # initialize the app with the arguments
+        app.initialize(["--template=basic"])
+        # create an exporter
+        app.exporter = HTMLExporter(config=app.config)
+        # get html output
+        html, _ = app.export_single_notebook(
+            notebook_filename=None, resources=None, input_buffer=io.StringIO(content)
+        )
     return html
 
 
 # check if a file is a binary
 def is_binary_file(filename: str) -> bool:
-    """ check if a file can be considered a binary file
+    """ check if a file can be considered a binary file (see file_type)
 
     Args:
         filename: str: the filename of the file to check
@@ -1110,39 +3293,83 @@ def is_binary_file(filename: str) -> bool:
         is_binary_string: bool: the truth value indicating wether the file is
             binary or not.
     """
-    textchars = (
-        bytearray([7, 8, 9, 10, 12, 13, 27])
-        + bytearray(range(0x20, 0x7F))
-        + bytearray(range(0x80, 0x100))
-    )
-    is_binary_string = lambda bytes: bool(bytes.translate(None, textchars))
-
-    if not os.path.exists(filename):
-        return False
-
-    if is_binary_string(open(filename, "rb").read(1024)):
-        return True
-    else:
+    try:
+        return file_type(filename) == "binary"
+    except OSError:
         return False
 
 
-# kill the websocket server
-def kill_websocket_server() -> int:
-    """ kills the websocket server
+# convert markdown to html in the render pool
+def isolated_md2body(content: str, tier: str = "full", parallel: bool = False) -> tuple:
+    """ convert markdown to html in the render pool, within a time and memory budget
 
-    TODO: find a way to do this more gracefully.
+    Args:
+        content: the markdown string to convert
+        tier: the render tier (see markdown_interpreter)
+        parallel: split the markdown into chunks rendered in parallel (see
+            parallel_md2body)
 
     Returns:
-        exit_status: the exit status of the subprocess `fuser -k` system call
+        html: str: the resulting html, without relative links rewritten
+        fallback: bool: whether the markdown is shown as text (see fallback2body)
     """
-    exit_status = subprocess.call(["fuser", "-k", f"{ARGS.websocket_port}/tcp"])
-    return exit_status
+    import concurrent.futures
+    from concurrent.futures.process import BrokenProcessPool
+
+    digest = hashlib.sha256(content.encode(errors="replace")).hexdigest()
+    key = (digest, tier, ARGS.render_timeout, ARGS.render_memory)
+    reason = failure_get(key)
+    if reason is None and tier == "full":  # what fails in the fast tier fails in full too
+        reason = failure_get((digest, "fast", *key[2:]))
+    if reason is not None:
+        return fallback2body(content, reason), True
+    try:
+        if parallel:
+            return parallel_md2body(content), False
+        future = render_pool().submit(chunk2body, content, tier)
+        html, counters = future.result(ARGS.render_timeout or None)
+        COUNTERS.update(counters)
+        return html, False
+    except concurrent.futures.TimeoutError:
+        reason = "timeout"
+        kill_render_pool()
+    except MemoryError:
+        reason = "memory"
+    except RecursionError:
+        reason = "recursion"
+    except BrokenProcessPool:
+        reason = "crash"  # e.g. a worker killed by the kernel or a stack overflow
+        kill_render_pool()
+    count_metric("smdv_render_failures_total", reason=reason)
+    if reason != "crash":
+        failure_put(key, reason)
+    return fallback2body(content, reason), True
+
+
+# kill the workers of the render pool
+def kill_render_pool():
+    """ kill the workers of the render pool (the pool is created again on next use) """
+    import signal
+
+    global RENDER_POOL
+    if RENDER_POOL is None:
+        return
+    while not RENDER_PIDS.empty():
+        try:
+            os.kill(RENDER_PIDS.get(), signal.SIGKILL)
+        except ProcessLookupError:
+            pass  # the worker already exited
+    RENDER_POOL.shutdown(wait=False)
+    RENDER_POOL = None
 
 
 # ask the number of
 def number_of_connected_jsclients():
     """ ask the websocket server for the number of connected js clients """
-    return EVENT_LOOP.run_until_complete(ask_num_js_clients())
+    try:
+        return control_request("clients")["jsclients"]
+    except OSError:
+        return event_loop().run_until_complete(ask_num_js_clients())
 
 
 # main smdv program
@@ -1156,50 +3383,42 @@ def main() -> int:
     try:
         default_args = parse_args(SMDV_DEFAULT_ARGS.split(" "))
         ARGS = parse_args(sys.argv[1:], **default_args.__dict__)
+        # only now the port is known (the defaults are parsed without -p):
+        ARGS.control_socket = ARGS.control_socket.replace("{port}", str(ARGS.port))
 
         # first do single-shot smdv flags:
         if ARGS.start_server:
-            run_flask_server()
-            return 0
-        if ARGS.stop_server:
-            exit_status = send_delete_request_to_server()
-            return exit_status
-        if ARGS.start_websocket_server:
-            run_websocket_server()
+            run_server()
             return 0
-        if ARGS.stop_websocket_server:
-            exit_status = kill_websocket_server()
+        if ARGS.stop_server or ARGS.stop:
+            exit_status = stop_server()
             return exit_status
         if ARGS.start:
-            run_server_in_subprocess(server="flask")
-            run_server_in_subprocess(server="websocket")
+            run_server_in_subprocess()
             return 0
-        if ARGS.stop:
-            exit_status1 = send_delete_request_to_server()
-            exit_status2 = kill_websocket_server()
-            exit_status = exit_status1 + exit_status2
-            return exit_status
         if ARGS.server_status:
-            print(request_server_status(server="flask"))
+            print(request_server_status())
             return 0
-        if ARGS.websocket_server_status:
-            print(request_server_status(server="websocket"))
+        if ARGS.bench:
+            run_benchmark()
             return 0
+        if ARGS.export:
+            stats = export(*ARGS.export)
+            for path, error in stats["failures"].items():
+                print(f"could not export {path}: {error}", file=sys.stderr)
+            print(
+                f"exported {ARGS.export[0]} to {ARGS.export[1]} in {stats['seconds']:.2f}s "
+                f"({stats['rendered']} rendered, {stats['copied']} copied, "
+                f"{stats['unchanged']} unchanged, {stats['removed']} removed, "
+                f"{stats['failed']} failed)"
+            )
+            return 1 if stats["failed"] else 0
 
-        # first, start websocket server. Assume the server is already running on failure
-        if ARGS.restart:  # force restart
-            kill_websocket_server()
-            wait_for_server(server="websocket", status="stopped")
-        run_server_in_subprocess(server="websocket")
-
-        # next, start smdv server. Assume the server is already running on failure
+        # first, start the smdv server (if it's not running yet)
         if ARGS.restart:  # force restart
-            send_delete_request_to_server()
-            wait_for_server(server="flask", status="stopped")
-        run_server_in_subprocess(server="flask")
-
-        # wait for the websocket server to be fully started:
-        wait_for_server(server="websocket", status="running")
+            restart_server()
+        elif request_server_status() == "stopped" and not run_server_in_subprocess():
+            wait_for_server(status="running")  # another smdv started the server first
 
         # if no browser connection can be found: open browser
         if not ARGS.no_browser and number_of_connected_jsclients() == 0:
@@ -1231,31 +3450,427 @@ def main() -> int:
         return 1
 
 
-def md2body(content: str = "") -> str:
+# get the markdown interpreter
+def markdown_interpreter(tier: str = "full"):
+    """ get the function converting markdown to html (which is created on first use)
+
+    The function uses the --markdown-backend. When markdown-it-py is selected
+    but not installed, python-markdown is used instead (with a warning).
+
+    Args:
+        tier: "full" for all MARKDOWN_EXTENSIIONS, "fast" for the
+            FAST_MARKDOWN_EXTENSIONS only (see render_tier)
+
+    Returns:
+        convert: function: converts a markdown string to an html string
+    """
+    backend = ARGS.markdown_backend
+    if (backend, tier) in MD_INTERPRETERS:
+        return MD_INTERPRETERS[backend, tier]
+    if backend == "markdown-it":
+        try:
+            MD_INTERPRETERS[backend, tier] = markdown_it_interpreter(tier).render
+            return MD_INTERPRETERS[backend, tier]
+        except ImportError:
+            warnings.warn("markdown-it-py is not installed, using python-markdown instead")
+    interpreter = python_markdown_interpreter(tier)
+
+    def convert(content: str) -> str:
+        return interpreter.reset().convert(content)
+
+    MD_INTERPRETERS[backend, tier] = convert
+    return convert
+
+
+# get the markdown-it interpreter
+def markdown_it_interpreter(tier: str = "full") -> "markdown_it.MarkdownIt":
+    """ create a markdown-it interpreter rendering like the python-markdown interpreter
+
+    Abbreviations, attribute lists and markdown in html are not supported.
+
+    Args:
+        tier: the render tier (see markdown_interpreter)
+
+    Returns:
+        interpreter: markdown_it.MarkdownIt: the interpreter
+    """
+    from markdown_it import MarkdownIt
+    from markdown_it.token import Token
+    from mdit_py_plugins.admon import admon_plugin
+    from mdit_py_plugins.deflist import deflist_plugin
+    from mdit_py_plugins.dollarmath import dollarmath_plugin
+    from mdit_py_plugins.footnote import footnote_plugin
+    from markdown.extensions.toc import slugify, unique
+
+    interpreter = MarkdownIt("commonmark", {"html": True}).enable("table")
+    interpreter.use(dollarmath_plugin, double_inline=True)
+    interpreter.use(footnote_plugin).use(deflist_plugin)
+
+    def render_math(self, tokens, idx, options, env):
+        display = "; mode=display" if tokens[idx].type != "math_inline" else ""
+        script = f'<script type="math/tex{display}">{tokens[idx].content}</script>'
+        return f"<p>\n{script}\n</p>\n" if tokens[idx].block else script
+
+    def render_footnote(self, tokens, idx, options, env):
+        token = tokens[idx]
+        if token.type == "footnote_block_open":
+            return '<div class="footnote">\n<hr />\n<ol>\n'
+        if token.type == "footnote_block_close":
+            return "</ol>\n</div>\n"
+        number = token.meta["id"] + 1
+        label = token.meta.get("label") or number
+        if token.type == "footnote_ref":
+            return f'<sup id="fnref:{label}"><a class="footnote-ref" href="#fn:{label}">{number}</a></sup>'
+        if token.type == "footnote_open":
+            return f'<li id="fn:{label}">\n'
+        return (  # footnote_anchor
+            f'&#160;<a class="footnote-backref" href="#fnref:{label}" '
+            f'title="Jump back to footnote {number} in the text">&#8617;</a>'
+        )
+
+    def align(state):
+        for token in state.tokens:
+            if token.type in {"th_open", "td_open"} and token.attrGet("style"):
+                token.attrSet("style", token.attrGet("style").replace(":", ": ") + ";")
+
+    for rule in ("math_inline", "math_inline_double", "math_block", "math_block_label"):
+        interpreter.add_render_rule(rule, render_math)
+    for rule in (
+        "footnote_ref",
+        "footnote_block_open",
+        "footnote_block_close",
+        "footnote_open",
+        "footnote_anchor",
+    ):
+        interpreter.add_render_rule(rule, render_footnote)
+    interpreter.core.ruler.push("align", align)
+
+    if tier == "fast":
+        return interpreter
+
+    interpreter.use(admon_plugin)
+
+    def render_fence(self, tokens, idx, options, env):
+        import pygments
+        import pygments.lexers
+        import pygments.formatters
+        import pygments.util
+
+        code, language = tokens[idx].content, tokens[idx].info.strip().split(" ")[0]
+        try:
+            lexer = pygments.lexers.get_lexer_by_name(language)
+        except pygments.util.ClassNotFound:
+            lexer = pygments.lexers.guess_lexer(code) if not language else pygments.lexers.TextLexer()
+        formatter = pygments.formatters.HtmlFormatter(cssclass="codehilite", wrapcode=True)
+        return pygments.highlight(code, lexer, formatter)
+
+    def toc(state):
+        headings, ids = [], set()
+        for i, token in enumerate(state.tokens):
+            if token.type == "heading_open":
+                title = "".join(
+                    child.content for child in state.tokens[i + 1].children or []
+                    if child.type in {"text", "code_inline"}
+                )
+                token.attrSet("id", unique(slugify(title, "-"), ids))
+                headings.append((int(token.tag[1]), token.attrGet("id"), title))
+        for i in reversed(range(1, len(state.tokens) - 1)):
+            token = state.tokens[i]
+            if token.type == "inline" and token.content.strip() == "[TOC]":
+                if state.tokens[i - 1].type == "paragraph_open":
+                    block = Token("html_block", "", 0)
+                    block.content = toc2body(headings) + "\n"
+                    state.tokens[i - 1 : i + 2] = [block]
+
+    interpreter.add_render_rule("fence", render_fence)
+    interpreter.core.ruler.push("toc", toc)
+    return interpreter
+
+
+def md2body(content: str = "", static_url: str = None, tier: str = "full") -> str:
     """ convert markdown to html using the github flavored markdown [gfm] spec of pandoc
 
     Args:
         content: the markdown string to convert
+        static_url: the url to prefix relative links with. By default, relative
+            links point to the static route of the smdv server for the current
+            working directory. An empty string leaves relative links untouched.
+        tier: the render tier (see markdown_interpreter)
 
     Returns:
         html: str: the resulting html
 
     """
+    return checked_md2body(content, static_url, tier)[0]
+
+
+# convert metric snapshots to the prometheus text exposition format
+def metrics2text(*snapshots: dict) -> str:
+    """ convert metric snapshots to the prometheus text exposition format
+
+    Args:
+        *snapshots: the metric snapshots (see `metrics_snapshot`) to convert
+
+    Returns:
+        text: str: the metrics in prometheus text exposition format
+    """
+    samples = collections.defaultdict(list)
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get("counters", []) + snapshot.get("gauges", []):
+            samples[name].append((name, labels, value))
+        for name, labels, counts, total in snapshot.get("histograms", []):
+            buckets = METRICS[name][2]
+            for le, count in zip(buckets + ("+Inf",), counts):
+                samples[name].append((f"{name}_bucket", {**labels, "le": str(le)}, count))
+            samples[name].append((f"{name}_sum", labels, total))
+            samples[name].append((f"{name}_count", labels, counts[-1]))
+
+    lines = []
+    for name in sorted(samples):
+        kind, description, _ = METRICS[name]
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample, labels, value in samples[name]:
+            labels = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+            lines.append(f"{sample}{{{labels}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# take a snapshot of the metrics collected by this process
+def metrics_snapshot(server: str, **gauges) -> dict:
+    """ take a json serializable snapshot of the metrics collected by this process
+
+    Args:
+        server: the name of the server taking the snapshot (added as label)
+        **gauges: the current values of the gauge metrics to include
 
-    html = MD_INTERPRETER.convert(content)
+    Returns:
+        snapshot: dict: the collected counters, gauges and (cumulative) histograms
+    """
+    snapshot = {"counters": [], "gauges": [], "histograms": []}
+    for (name, labels), value in list(COUNTERS.items()):
+        snapshot["counters"].append((name, dict(labels, server=server), value))
+    for name, value in gauges.items():
+        snapshot["gauges"].append((name, {"server": server}, value))
+    for (name, labels), counts in list(HISTOGRAMS.items()):
+        cumulative = [sum(counts[: i + 1]) for i in range(len(counts) - 1)]
+        snapshot["histograms"].append(
+            (name, dict(labels, server=server), cumulative, counts[-1])
+        )
+    return snapshot
 
-    urls = (re.findall('src="(.*?)"', html)
-            + re.findall("src='(.*?)'", html)
-            + re.findall('href="(.*?)"', html)
-            + re.findall("href='(.*?)'", html))
 
+# attach to the neovim buffer of a file
+def nvim_attach(path: str):
+    """ stream the neovim buffer of a file to the js clients (see --nvim-attach)
 
-    cwd = os.path.abspath(os.getcwd()).replace(ARGS.home, "") + "/"
-    for url in urls:
-        if not (url.startswith("/") or url.startswith("http://") or url.startswith("https://")):
-            html = html.replace(url, f"http://{ARGS.host}:{ARGS.port}/@static{cwd}{url}")
+    Args:
+        path: the (absolute) path of the file to attach to
+    """
+    if path == NVIM_BUFFER["path"]:
+        return
+    handle = NVIM_BUFFER["handle"]
+    NVIM_BUFFER.update(path=path, handle=None, lines=[])
+    address = ARGS.nvim_address.strip()
 
-    return html
+    def attach():  # connecting to neovim may block: don't block the event loop
+        try:
+            if not nvim_call(address, nvim_attach_buffer, path, handle):
+                event_loop().call_soon_threadsafe(nvim_set_handle, path, None)
+        except ImportError:
+            warnings.warn("--nvim-attach requires pynvim (pip install pynvim)")
+
+    threading.Thread(target=attach, daemon=True).start()
+
+
+# attach to a buffer (in the thread of the pynvim session)
+def nvim_attach_buffer(nvim: "pynvim.Nvim", path: str, previous: int = None):
+    """ attach to the neovim buffer of a file (in the thread of the pynvim session)
+
+    Args:
+        nvim: the pynvim session
+        path: the path of the file to attach to
+        previous: the handle of the buffer to detach from
+    """
+    import pynvim
+
+    try:
+        if previous is not None:
+            nvim.request("nvim_buf_detach", previous)
+        for buffer in nvim.buffers:
+            if buffer.name == path:
+                event_loop().call_soon_threadsafe(nvim_set_handle, path, buffer.handle)
+                nvim.request("nvim_buf_attach", buffer, True, {})
+                return
+    except (pynvim.NvimError, OSError):
+        pass  # the buffer was closed in the meantime
+    event_loop().call_soon_threadsafe(nvim_set_handle, path, None)
+
+
+# call a function in the thread of a pynvim session
+def nvim_call(address: str, func, *args) -> bool:
+    """ call a function with the pynvim session to the neovim server at address
+
+    The function is called in the thread of the (persistent) pynvim session,
+    which is reconnected once when the session turns out to be broken.
+
+    Args:
+        address: the address (host:port) or unix socket of the neovim server
+        func: the function to call (with the session as first argument)
+        *args: the other arguments to call the function with
+
+    Returns:
+        reachable: bool: whether neovim was reachable (even when the function
+            raised an error in neovim, like E37 on unsaved changes)
+    """
+    import concurrent.futures, pynvim
+
+    for _ in range(2):
+        nvim = nvim_session(address)
+        if nvim is None:
+            return False
+        result = concurrent.futures.Future()
+
+        def call():
+            try:
+                result.set_result(func(nvim, *args))
+            except Exception as e:
+                result.set_exception(e)
+
+        try:
+            nvim.async_call(call)
+            result.result(timeout=5.0)
+            return True
+        except pynvim.NvimError:
+            return True
+        except (OSError, EOFError, RuntimeError, concurrent.futures.TimeoutError):
+            if NVIM_SESSIONS.get(address) is nvim:
+                NVIM_SESSIONS.pop(address)  # reconnect
+            with contextlib.suppress(OSError, RuntimeError):
+                nvim.async_call(nvim.stop_loop)
+    return False
+
+
+# forget a detached neovim buffer
+def nvim_detach_event(handle: int):
+    """ forget a neovim buffer that was detached (e.g. because it was unloaded)
+
+    Args:
+        handle: the handle of the detached buffer
+    """
+    if handle == NVIM_BUFFER["handle"]:
+        nvim_set_handle(NVIM_BUFFER["path"], None)
+
+
+# apply the line changes of a neovim buffer
+def nvim_lines_event(handle: int, firstline: int, lastline: int, lines: list):
+    """ apply the line changes of a neovim buffer (see nvim_buf_lines_event)
+
+    Args:
+        handle: the handle of the changed buffer
+        firstline: the first replaced line (0-based)
+        lastline: the line after the last replaced line (-1 for the whole buffer)
+        lines: the replacement lines
+    """
+    if handle is None or handle != NVIM_BUFFER["handle"]:
+        return  # events of a buffer that is no longer shown
+    buffer = NVIM_BUFFER["lines"]
+    buffer[firstline : len(buffer) if lastline == -1 else lastline] = lines
+    NVIM_BUFFER["dirty"] = True
+    if NVIM_BUFFER["task"] is None:
+        NVIM_BUFFER["task"] = track(stream_nvim_buffer())
+
+
+# handle a notification sent by neovim (in the thread of the pynvim session)
+def nvim_notification(name: str, args: list):
+    """ handle a notification sent by neovim (in the thread of the pynvim session)
+
+    Args:
+        name: the name of the notification (e.g. nvim_buf_lines_event)
+        args: the arguments of the notification
+    """
+    if name == "nvim_buf_lines_event":
+        buffer, _, firstline, lastline, lines, _ = args
+        event_loop().call_soon_threadsafe(
+            nvim_lines_event, buffer.handle, firstline, lastline, lines
+        )
+    elif name == "nvim_buf_detach_event":
+        event_loop().call_soon_threadsafe(nvim_detach_event, args[0].handle)
+
+
+# get the pynvim session to a neovim server
+def nvim_session(address: str) -> "pynvim.Nvim":
+    """ get the (persistent) pynvim session to the neovim server at address
+
+    Args:
+        address: the address (host:port) or unix socket of the neovim server
+
+    Returns:
+        nvim: the pynvim session or None when neovim is not reachable
+    """
+    import pynvim
+
+    with NVIM_SESSIONS_LOCK:
+        if address in NVIM_SESSIONS:
+            return NVIM_SESSIONS[address]
+        connected = threading.Event()
+
+        def run():
+            try:
+                if ":" in address:  # inet socket
+                    host, port = address.rsplit(":", 1)
+                    nvim = pynvim.attach("tcp", address=host, port=int(port))
+                else:  # unix socket
+                    nvim = pynvim.attach("socket", path=address)
+            except (OSError, EOFError, ValueError):
+                connected.set()
+                return
+            NVIM_SESSIONS[address] = nvim
+            connected.set()
+            try:
+                nvim.run_loop(None, nvim_notification)
+            except (OSError, EOFError):
+                pass  # neovim quit
+            finally:
+                NVIM_SESSIONS.pop(address, None)
+                nvim.close()
+
+        threading.Thread(target=run, daemon=True).start()
+        connected.wait(5.0)
+        return NVIM_SESSIONS.get(address)
+
+
+# set the handle of the streamed neovim buffer
+def nvim_set_handle(path: str, handle: int):
+    """ set the handle of the neovim buffer streamed with --nvim-attach
+
+    Args:
+        path: the path of the file in the buffer
+        handle: the buffer handle (None when the buffer could not be attached
+            to or was detached)
+    """
+    if path == NVIM_BUFFER["path"]:
+        NVIM_BUFFER["handle"] = handle
+        if handle is None:
+            NVIM_BUFFER["path"] = ""  # attach again when the file is shown again
+
+
+# record a value in a histogram metric
+def observe_metric(name: str, value: float, **labels):
+    """ record a value in a histogram metric
+
+    Args:
+        name: the name of the histogram (should be defined in METRICS)
+        value: the value to record
+        **labels: the labels of the histogram
+    """
+    key = (name, tuple(sorted(labels.items())))
+    buckets = METRICS[name][2]
+    counts = HISTOGRAMS.get(key)
+    if counts is None:
+        counts = HISTOGRAMS[key] = [0] * (len(buckets) + 2)
+    counts[bisect.bisect_left(buckets, value)] += 1
+    counts[-1] += value
 
 
 # open a new browser
@@ -1265,6 +3880,8 @@ def open_browser():
     Args:
         filename: str="": the filename to open the browser at.
     """
+    import webbrowser
+
     url = f"http://{ARGS.host}:{ARGS.port}"
     if ARGS.browser == "chromium --app":
         subprocess.Popen(["chromium", f"--app={url}"])
@@ -1276,6 +3893,100 @@ def open_browser():
         webbrowser.open(url)
 
 
+# convert large markdown to html in parallel
+def parallel_md2body(content: str) -> str:
+    """ convert large markdown to html with the processes of the render pool
+
+    Args:
+        content: the markdown string to convert
+
+    Returns:
+        html: str: the resulting html, without relative links rewritten
+    """
+    import html
+    from markdown.extensions.toc import unique
+
+    workers = ARGS.render_workers
+    chunks, references, footnotes = split_chunks(
+        content, len(content) // (4 * workers) + 1, ARGS.markdown_backend != "markdown-it"
+    )
+    if len(chunks) < 2:
+        return markdown_interpreter()(content)
+    references = "".join("\n\n" + reference for reference in references)
+    footnotes = "\n" + "\n".join(footnotes) if footnotes else ""
+    chunks = [chunk + references + (footnotes if "[^" in chunk else "") for chunk in chunks]
+    bodies, notes = [], {}
+    for body, counters in render_pool().map(chunk2body, chunks, timeout=ARGS.render_timeout or None):
+        COUNTERS.update(counters)
+        start = body.rfind('<div class="footnote">')
+        if start >= 0:
+            for label, note in re.findall(
+                r'<li id="fn:([^"]*)">\n(.*?)</li>\n(?=<li id="fn:|</ol>)', body[start:], re.S
+            ):
+                notes.setdefault(label, note)
+            body = body[:start].rstrip("\n")
+        bodies.append(body)
+    body = "\n".join(bodies)
+
+    if notes:  # python-markdown numbers footnotes by definition, markdown-it by reference
+        markdown_it = ARGS.markdown_backend == "markdown-it"
+        order = list(notes)
+        if markdown_it:
+            order = re.findall(r'<sup id="fnref\d*:([^"]*)">', body)
+            order = [label for label in dict.fromkeys(order) if label in notes]
+        numbers = {label: number for number, label in enumerate(order, 1)}
+        body = re.sub(
+            r'(<a class="footnote-ref" href="#fn:([^"]*)">)\d+',
+            lambda match: f"{match.group(1)}{numbers.get(match.group(2), '')}",
+            body,
+        )
+        references = collections.Counter()
+
+        def reference_id(match):  # python-markdown numbers repeated references: fnref2, ...
+            label = match.group(1)
+            references[label] += 1
+            number = "" if markdown_it or references[label] == 1 else references[label]
+            return f'<sup id="fnref{number}:{label}">'
+
+        body = re.sub(r'<sup id="fnref\d*:([^"]*)">', reference_id, body)
+
+        def backreferences(label):  # a back-reference per reference (in the whole document)
+            anchors = [
+                f'<a class="footnote-backref" href="#fnref{"" if markdown_it or n == 1 else n}:'
+                f'{label}" title="Jump back to footnote {numbers[label]} in the text">&#8617;</a>'
+                for n in range(1, max(references[label], 1) + 1)
+            ]
+            return "&#160;" + ("&#160;" if markdown_it else "").join(anchors)
+
+        items = [
+            f'<li id="fn:{label}">\n'
+            + re.sub(
+                r'&#160;<a class="footnote-backref" .*?</a>'
+                r'(?:(?:&#160;)?<a class="footnote-backref" .*?</a>)*',
+                lambda _: backreferences(label),
+                notes[label],
+                count=1,
+            )
+            + "</li>"
+            for label in order
+        ]
+        body += '\n<div class="footnote">\n<hr />\n<ol>\n' + "\n".join(items) + "\n</ol>\n</div>"
+        body += "\n" if ARGS.markdown_backend == "markdown-it" else ""
+
+    ids, headings = set(), []
+
+    def unique_id(match):
+        level, before, anchor, after, title = match.groups()
+        anchor = unique(anchor, ids)
+        headings.append((int(level), anchor, html.unescape(re.sub("<[^>]+>", "", title))))
+        return f'<h{level}{before} id="{anchor}"{after}>{title}</h{level}>'
+
+    body = re.sub(r'<h([1-6])([^>]*?) id="([^"]*)"([^>]*)>(.*?)</h\1>', unique_id, body)
+    if '<div class="toc">' in body:
+        body = re.sub('<div class="toc">.*?</div>', lambda _: toc2body(headings), body, flags=re.S)
+    return body
+
+
 # parse command line arguments
 def parse_args(args: tuple, **kwargs) -> argparse.Namespace:
     """ populate the smdv command line arguments
@@ -1317,13 +4028,7 @@ def parse_args(args: tuple, **kwargs) -> argparse.Namespace:
         "-p",
         "--port",
         default=kwargs.get("port", "9876"),
-        help="port on which smdv is served.",
-    )
-    parser.add_argument(
-        "-w",
-        "--websocket-port",
-        default=kwargs.get("websocket_port", "9877"),
-        help="port for websocket communication",
+        help="port on which smdv (both http and websockets) is served.",
     )
     parser.add_argument(
         "--host",
@@ -1332,10 +4037,16 @@ def parse_args(args: tuple, **kwargs) -> argparse.Namespace:
         choices=["localhost", "127.0.0.1"],
     )
     parser.add_argument(
-        "--websocket-host",
-        default=kwargs.get("websocket_host", "localhost"),
-        help="host for websocket communication (for now, only localhost is supported)",
-        choices=["localhost", "127.0.0.1"],
+        "--control-socket",
+        default=kwargs.get(
+            "control_socket",
+            os.path.join(
+                os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir()),
+                f"smdv-{os.getuid()}-{{port}}.sock",
+            ),
+        ),
+        help=("unix domain socket used by the smdv CLI to control the smdv "
+              "server (empty: connect over websockets instead)"),
     )
     parser.add_argument(
         "--md-css-cdn",
@@ -1356,7 +4067,8 @@ def parse_args(args: tuple, **kwargs) -> argparse.Namespace:
         "--restart",
         action="store_true",
         default=kwargs.get("restart", False),
-        help="force a restart of smdv (both servers)",
+        help=("restart the smdv server (connected browsers reconnect to the new "
+              "server)"),
     )
     parser.add_argument(
         "--hide-navbar",
@@ -1391,6 +4103,183 @@ def parse_args(args: tuple, **kwargs) -> argparse.Namespace:
         help=("open smdv in interactive mode (every file opened in "
               "smdv will also automatically be opened in vim)."),
     )
+    parser.add_argument(
+        "-f",
+        "--follow",
+        action="store_true",
+        default=kwargs.get("follow", False),
+        help=("follow the growing file (like tail -f): show the lines appended "
+              "to the file as they are written."),
+    )
+    parser.add_argument(
+        "--follow-max-lines",
+        type=int,
+        default=kwargs.get("follow_max_lines", FOLLOW_MAX_LINES),
+        help="the number of lines of a followed file (or of stdin) kept in the browser.",
+    )
+    parser.add_argument(
+        "--nvim-attach",
+        action="store_true",
+        default=kwargs.get("nvim_attach", False),
+        help=("show the changes to a file in neovim while typing (without saving "
+              "the file) by attaching to its buffer at --nvim-address (requires pynvim)."),
+    )
+    parser.add_argument(
+        "--bench-jsclients",
+        type=int,
+        default=kwargs.get("bench_jsclients", 50),
+        help="number of fake browser clients to connect during --bench",
+    )
+    parser.add_argument(
+        "--bench-producers",
+        type=int,
+        default=kwargs.get("bench_producers", 1),
+        help="number of fake editors sending updates during --bench",
+    )
+    parser.add_argument(
+        "--bench-rate",
+        type=float,
+        default=kwargs.get("bench_rate", 10.0),
+        help="number of updates per second sent by each producer during --bench",
+    )
+    parser.add_argument(
+        "--bench-duration",
+        type=float,
+        default=kwargs.get("bench_duration", 10.0),
+        help="number of seconds the producers send updates during --bench",
+    )
+    parser.add_argument(
+        "--bench-size",
+        type=int,
+        default=kwargs.get("bench_size", 10000),
+        help="approximate size (in bytes) of the markdown sent in each update",
+    )
+    parser.add_argument(
+        "--bench-via",
+        default=kwargs.get("bench_via", "put"),
+        choices=["put", "websocket", "control"],
+        help=("send updates with PUT requests (like an editor plugin), over a "
+              "websocket or over the control socket (like `smdv filename`)"),
+    )
+    parser.add_argument(
+        "--size-budget",
+        nargs="*",
+        metavar="ENCODING=MB",
+        default=kwargs.get("size_budget", []),
+        help=("the size (in MB) up to which files are rendered per encoding, e.g. "
+              "md=20 txt=50 (larger files are truncated). Defaults to "
+              + " ".join(f"{k}={v}" for k, v in SIZE_BUDGETS.items()) + "."),
+    )
+    parser.add_argument(
+        "--markdown-backend",
+        default=kwargs.get("markdown_backend", "python-markdown"),
+        choices=MARKDOWN_BACKENDS,
+        help=("the library rendering markdown: python-markdown or the (faster, "
+              "CommonMark compliant) markdown-it-py, if installed"),
+    )
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        default=kwargs.get("render_workers", os.cpu_count() or 1),
+        help=("the number of processes rendering markdown (markdown larger than 0.5 MB "
+              "is rendered in parallel). Defaults to the number of cpus."),
+    )
+    parser.add_argument(
+        "--render-timeout",
+        type=float,
+        default=kwargs.get("render_timeout", 20.0),
+        help=("the time (in seconds) a markdown render (of 5 kB or more) may take before "
+              "it is killed and the markdown is shown as text (0: render in the server "
+              "process, without time and memory budget)"),
+    )
+    parser.add_argument(
+        "--render-memory",
+        type=float,
+        default=kwargs.get("render_memory", 2000.0),
+        help=("the memory (in MB) of a process rendering markdown, beyond which the "
+              "markdown is shown as text (0: unlimited)"),
+    )
+    parser.add_argument(
+        "--fast-render-size",
+        type=float,
+        default=kwargs.get("fast_render_size", 2.0),
+        help=("markdown larger than this (in MB) is first shown without highlighting, "
+              "toc and most extensions, and then upgraded section by section (0: "
+              "always render in full)"),
+    )
+    parser.add_argument(
+        "--fast-render-blocks",
+        type=int,
+        default=kwargs.get("fast_render_blocks", 2000),
+        help=("markdown with more code blocks and display equations than this is "
+              "first shown without highlighting as well (0: no limit)"),
+    )
+    parser.add_argument(
+        "--render-cache-size",
+        type=float,
+        default=kwargs.get("render_cache_size", 64),
+        help="maximum size (in MB) of the in-memory cache of rendered files",
+    )
+    parser.add_argument(
+        "--disk-cache-size",
+        type=float,
+        default=kwargs.get("disk_cache_size", 256),
+        help=("maximum size (in MB) of the persistent cache of rendered files, "
+              "shared by all smdv processes (0: disable the persistent cache)"),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=kwargs.get(
+            "cache_dir",
+            os.path.join(
+                os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "smdv"
+            ),
+        ),
+        help="directory of the persistent cache (uses $XDG_CACHE_HOME/smdv by default)",
+    )
+    parser.add_argument(
+        "--prerender-budget",
+        type=float,
+        default=kwargs.get("prerender_budget", 2.0),
+        help=("maximum time (in seconds) spent prerendering the md and ipynb files of "
+              "a directory after it is shown (0: disable prerendering)"),
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=kwargs.get("profile", False),
+        help=("write a chrome trace of the requests handled by the server to "
+              "--profile-dir (only has effect when the server is (re)started)"),
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=kwargs.get(
+            "profile_dir", os.path.join(tempfile.gettempdir(), "smdv-profile")
+        ),
+        help="directory to write the profiling results to",
+    )
+    parser.add_argument(
+        "--profile-every",
+        type=int,
+        default=kwargs.get("profile_every", 0),
+        help=("also sample every n-th request with cProfile and tracemalloc while "
+              "profiling (0: never)"),
+    )
+    parser.add_argument(
+        "--listen-fds",
+        type=int,
+        nargs="*",
+        default=kwargs.get("listen_fds", []),
+        help=("file descriptors of inherited listening sockets to serve on instead "
+              "of binding --port (used by the smdv server when restarting)"),
+    )
+    parser.add_argument(
+        "--ready-fd",
+        type=int,
+        default=kwargs.get("ready_fd", -1),
+        help=("file descriptor to write the server pid to as soon as the server "
+              "accepts connections (used by the smdv CLI when starting the server)"),
+    )
     single_shot_arguments = parser.add_mutually_exclusive_group()
     single_shot_arguments.add_argument(
         "--server-status",
@@ -1398,12 +4287,6 @@ def parse_args(args: tuple, **kwargs) -> argparse.Namespace:
         default=kwargs.get("server_status", False),
         help="ask status of the smdv server",
     )
-    single_shot_arguments.add_argument(
-        "--websocket-server-status",
-        action="store_true",
-        default=kwargs.get("websocket_server_status", False),
-        help="ask status of the smdv server",
-    )
     single_shot_arguments.add_argument(
         "--start-server",
         action="store_true",
@@ -1417,32 +4300,40 @@ def parse_args(args: tuple, **kwargs) -> argparse.Namespace:
         help="stop the smdv server (without doing anything else)",
     )
     single_shot_arguments.add_argument(
-        "--start-websocket-server",
+        "--stop",
         action="store_true",
-        default=kwargs.get("start_websocket_server", False),
-        help="start the smdv websocket server (without doing anything else)",
+        default=kwargs.get("stop", False),
+        help="stop smdv running in the background",
     )
     single_shot_arguments.add_argument(
-        "--stop-websocket-server",
+        "--start",
         action="store_true",
-        default=kwargs.get("stop_websocket_server", False),
-        help="stop the smdv websocket server (without doing anything else)",
+        default=kwargs.get("start", False),
+        help="start smdv in the background",
     )
     single_shot_arguments.add_argument(
-        "--stop",
+        "--bench",
         action="store_true",
-        default=kwargs.get("stop", False),
-        help="stop smdv running in the background (kills both servers)",
+        default=kwargs.get("bench", False),
+        help="load test smdv with fake browsers and editors (see --bench-* flags)",
     )
     single_shot_arguments.add_argument(
-        "--start",
-        action="store_true",
-        default=kwargs.get("start", False),
-        help="start smdv (both servers)",
+        "--export",
+        nargs=2,
+        metavar=("SRC", "DEST"),
+        default=kwargs.get("export", None),
+        help="export the directory tree SRC as a static html site to DEST",
     )
     parsed_args = parser.parse_args(args=args)
     if parsed_args.stdin is None:
         parsed_args.stdin = "md"
+    try:
+        budgets = parsed_args.size_budget
+        if not isinstance(budgets, dict):  # already parsed when passed as default
+            budgets = dict(budget.split("=", 1) for budget in budgets)
+        parsed_args.size_budget = {**SIZE_BUDGETS, **{k: float(v) for k, v in budgets.items()}}
+    except ValueError:
+        parser.error(f"invalid --size-budget {' '.join(parsed_args.size_budget)}")
     if parsed_args.home.endswith("/"):
         parsed_args.home = parsed_args.home[:-1]
     if not os.path.isdir(parsed_args.home):
@@ -1452,111 +4343,384 @@ def parse_args(args: tuple, **kwargs) -> argparse.Namespace:
     return parsed_args
 
 
-# print a message (useful for logging)
-def print_message(message: dict, **kwargs):
-    """ print a message
+# print a message (useful for logging)
+def print_message(message: dict, **kwargs):
+    """ print a message
+
+    Args:
+        message: the message to print nicely
+        **kwargs: the keyword arguments to print/suppress (defaults to all true)
+    """
+    indent = kwargs.pop("indent", 0)
+    for k, v in message.items():
+        if kwargs.get(k, True):
+            if k == "fileBody" or k == "cwdBody":
+                v = v[:20]
+            print(f"{'    '*indent}{k}\t{repr(v)}")
+
+
+# get the python-markdown interpreter
+def python_markdown_interpreter(tier: str = "full") -> "markdown.Markdown":
+    """ create the python-markdown interpreter of a render tier
+
+    The processors of the extensions are timed, such that the time spent per
+    extension shows up in the smdv_extension_duration_seconds_total metric.
+
+    Args:
+        tier: the render tier (see markdown_interpreter)
+
+    Returns:
+        interpreter: markdown.Markdown: the interpreter with the extensions of the tier loaded
+    """
+    import markdown
+
+    extensions = MARKDOWN_EXTENSIIONS if tier == "full" else FAST_MARKDOWN_EXTENSIONS
+    interpreter = markdown.Markdown(
+        extensions=extensions,
+        extension_configs={
+            k: v for k, v in MARKDOWN_EXTENSION_CONFIGS.items() if k in extensions
+        },
+    )
+    for registry in (  # inline patterns are not timed (they are called per match)
+        interpreter.preprocessors,
+        interpreter.parser.blockprocessors,
+        interpreter.treeprocessors,
+        interpreter.postprocessors,
+    ):
+        for processor in registry:
+            module = type(processor).__module__
+            if module.startswith("markdown.") and ".extensions." not in module:
+                continue  # the core of python-markdown
+            extension = module.rsplit(".", 1)[-1]
+            processor.run = timed_extension(processor.run, extension, tier)
+    return interpreter
+
+
+# read a file (within the size budget of its encoding)
+def read_file(filename: str, encoding: str) -> tuple:
+    """ read a (utf-8) text file, within the size budget of its encoding
+
+    Files larger than the --size-budget of their encoding are truncated.
+
+    Args:
+        filename: the filename of the file to read
+        encoding: the encoding the file is rendered with (see file_type)
+
+    Returns:
+        content: str: the (possibly truncated) content of the file
+        digest: str: the sha256 hash of the content (as read from the file)
+    """
+    import mmap
+
+    budget = int(ARGS.size_budget.get(encoding, SIZE_BUDGETS["txt"]) * 1e6)
+    with open(filename, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size < MMAP_MIN_SIZE:
+            data = file.read(budget)
+            content, digest = data.decode(errors="replace"), hashlib.sha256(data).hexdigest()
+        else:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                with memoryview(mapping) as view:
+                    content = str(view[:budget], "utf-8", "replace")
+                    digest = hashlib.sha256(view[:budget]).hexdigest()
+    if size > budget:
+        content += (
+            f"\n\n[smdv: only the first {budget / 1e6:g} MB of this {size / 1e6:.0f} MB "
+            f"file are shown, see --size-budget]\n"
+        )
+    return content, digest
+
+
+# get the render pool
+def render_pool() -> "concurrent.futures.ProcessPoolExecutor":
+    """ get the process pool rendering large markdown (which is created on first use)
+
+    Returns:
+        pool: concurrent.futures.ProcessPoolExecutor: the pool with --render-workers processes
+    """
+    import concurrent.futures, multiprocessing
+
+    global RENDER_POOL, RENDER_PIDS
+    if RENDER_POOL is None:
+        RENDER_PIDS = multiprocessing.SimpleQueue()
+        RENDER_POOL = concurrent.futures.ProcessPoolExecutor(
+            ARGS.render_workers, initializer=initialize_worker, initargs=(ARGS, RENDER_PIDS)
+        )
+    return RENDER_POOL
+
+
+# render a section of the shown file
+def render_section(index: int, tier: str, key: tuple) -> str:
+    """ render a section of the file in UPGRADE (unless it is rendered already)
+
+    Args:
+        index: the index of the section (see degraded_md2body)
+        tier: the render tier to render the section in (see render_tier)
+        key: the render cache key of the file the section belongs to
+
+    Returns:
+        html: str: the html of the section, in the given tier or in full (None
+            if the file is not in UPGRADE anymore or has no such section)
+    """
+    if UPGRADE["key"] != key or not 0 <= index < len(UPGRADE["sections"]):
+        return None
+    section, html, rendered = UPGRADE["sections"][index]
+    if rendered in {tier, "full"}:
+        return html
+    if tier == "fast":
+        html, fallback = checked_md2body(section, UPGRADE["static_url"], tier="fast")
+    elif len(UPGRADE["sections"]) > 1:
+        html, fallback = section2body(section, UPGRADE["static_url"])
+    else:
+        html, fallback = checked_md2body(section, UPGRADE["static_url"])
+    UPGRADE["sections"][index][1:] = [html, "fallback" if fallback else tier]
+    return html
+
+
+# get the render tier of markdown
+def render_tier(content: str) -> str:
+    """ get the render tier of markdown based on its size and complexity
+
+    Args:
+        content: the markdown to render
+
+    Returns:
+        tier: str: "fast" when the markdown is larger than --fast-render-size
+            or has more code blocks and display equations than
+            --fast-render-blocks, "full" otherwise.
+    """
+    if 0 < ARGS.fast_render_size and ARGS.fast_render_size * 1e6 < len(content):
+        return "fast"
+    if 0 < ARGS.fast_render_blocks < len(content) // 8:  # a block takes 8 characters at least
+        blocks = len(re.findall(r"^ {0,3}(?:```|~~~|\$\$)", content, re.MULTILINE)) // 2
+        if ARGS.fast_render_blocks < blocks:
+            return "fast"
+    return "full"
+
+
+# get the version of the renderer
+@functools.lru_cache(maxsize=None)
+def renderer_version() -> str:
+    """ get a version string identifying the renderer and its configuration
 
-    Args:
-        message: the message to print nicely
-        **kwargs: the keyword arguments to print/suppress (defaults to all true)
+    Returns:
+        version: str: the smdv and markdown versions, the backend and the extension configs
     """
-    indent = kwargs.pop("indent", 0)
-    for k, v in message.items():
-        if kwargs.get(k, True):
-            if k == "fileBody" or k == "cwdBody":
-                v = v[:20]
-            print(f"{'    '*indent}{k}\t{repr(v)}")
+    import markdown
+
+    backend = ARGS.markdown_backend
+    if backend == "markdown-it":
+        try:
+            import markdown_it
+            import mdit_py_plugins
+
+            backend += f"-{markdown_it.__version__}-{mdit_py_plugins.__version__}"
+        except ImportError:
+            backend = "python-markdown"  # see markdown_interpreter
+    return repr(
+        (
+            __version__,
+            markdown.__version__,
+            backend,
+            MARKDOWN_EXTENSIIONS,
+            MARKDOWN_EXTENSION_CONFIGS,
+        )
+    )
 
 
 # get status for the smdv server
-def request_server_status(server: str = "flask") -> str:
+def request_server_status() -> str:
     """ request the smdv server status
 
-    Args:
-        server: the server to ask the status for ["flask", "websocket"]
-
     Returns:
         status: str: the smdv server status
     """
-    if server == "websocket":
-        connection = http.client.HTTPConnection(
-            ARGS.websocket_host, ARGS.websocket_port
-        )
-    elif server == "flask":
-        connection = http.client.HTTPConnection(ARGS.host, ARGS.port)
-    else:
-        raise ValueError(
-            "request_server_status expects a server value of 'flask' or 'server'"
-        )
     try:
-        connection.connect()
+        control_request("status")
+        return "running"
+    except OSError:
+        pass  # no control socket: check the port
+    try:
+        socket.create_connection((ARGS.host, ARGS.port)).close()
         server_status = "running"
     except ConnectionRefusedError:
         server_status = "stopped"
-    finally:
-        connection.close()
     return server_status
 
 
-# run the flask server
-def run_flask_server():
-    """ start the flask server """
-    create_app().run(debug=False, port=ARGS.port, host=ARGS.host, threaded=True)
+# restart the smdv server
+def restart_server():
+    """ restart the smdv server (with the current configuration) """
+    try:
+        control_request("restart", args=server_args(), timeout=10.0)
+        return
+    except OSError:
+        pass  # no control socket: cold restart
+    stop_server()
+    wait_for_server(status="stopped")
+    if not run_server_in_subprocess():
+        wait_for_server(status="running")
 
 
-# run server in new subprocess
-def run_server_in_subprocess(server="flask"):
-    """ start the websocket server in a subprocess
+# run the load benchmark
+def run_benchmark() -> dict:
+    """ start the smdv server (if needed) and load test it on localhost
 
-    Args:
-        server: which server to run in subprocess ["flask", "websocket"]
+    Returns:
+        report: dict: the latency percentiles, throughput and dropped updates
     """
-    args = {
-        "--home": ARGS.home,
-        "--stdin": ARGS.stdin,
-        "--port": ARGS.port,
-        "--websocket-port": ARGS.websocket_port,
-        "--host": ARGS.host,
-        "--websocket-host": ARGS.websocket_host,
-        "--md-css-cdn": ARGS.md_css_cdn,
-        "--nvim-address": ARGS.nvim_address,
-    }
+    if request_server_status() == "stopped" and not run_server_in_subprocess():
+        wait_for_server(status="running")  # another smdv started the server first
 
-    args_list = [str(s) for kv in args.items() for s in kv]  # flattened dict as list
-    if ARGS.interactive:
-        args_list += ["--interactive"]
-    if server == "flask":
-        args_list += ["--start-server"]
-    elif server == "websocket":
-        args_list += ["--start-websocket-server"]
+    stats = event_loop().run_until_complete(
+        benchmark(
+            ARGS.bench_jsclients, ARGS.bench_producers, ARGS.bench_rate, ARGS.bench_duration
+        )
+    )
+
+    latencies = sorted(
+        timestamp - stats["sent"][marker]
+        for marker, timestamps in stats["received"].items()
+        for timestamp in timestamps
+    )
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+    expected = len(stats["sent"]) * ARGS.bench_jsclients
+    report = {
+        "updates": len(stats["sent"]),
+        "expected": expected,
+        "delivered": len(latencies),
+        "dropped": expected - len(latencies),
+        "throughput": len(latencies) / stats["duration"],
+        "p50": percentile(0.50) if latencies else float("nan"),
+        "p99": percentile(0.99) if latencies else float("nan"),
+    }
+    print(
+        f"smdv benchmark: {ARGS.bench_jsclients} js clients, {ARGS.bench_producers} "
+        f"producer(s) ({ARGS.bench_via}) at {ARGS.bench_rate} updates/s for "
+        f"{ARGS.bench_duration}s\n"
+        f"updates sent:      {report['updates']}\n"
+        f"updates delivered: {report['delivered']}/{report['expected']} "
+        f"({report['dropped']} dropped)\n"
+        f"throughput:        {report['throughput']:.1f} deliveries/s\n"
+        f"latency p50:       {report['p50']*1e3:.1f} ms\n"
+        f"latency p99:       {report['p99']*1e3:.1f} ms"
+    )
+    return report
+
+
+# run the smdv server
+def run_server():
+    """ start and run the smdv server """
+    import asyncio
+
+    global CONTROL_SERVER
+    global CONTROL_SOCKET_INODE
+    if ARGS.profile:
+        start_profiling(server="server")
+    if ARGS.listen_fds:  # take over the listening sockets of the previous server
+        for fd in ARGS.listen_fds:
+            SERVERS.append(
+                event_loop().run_until_complete(
+                    asyncio.start_server(serve_http_client, sock=socket.socket(fileno=fd))
+                )
+            )
     else:
-        raise ValueError(
-            "server to start in subprocess should be either 'flask' or 'websocket'"
+        SERVERS.append(
+            event_loop().run_until_complete(
+                asyncio.start_server(serve_http_client, ARGS.host, ARGS.port)
+            )
         )
+    if ARGS.control_socket:
+        # the port is ours, hence an existing control socket is stale:
+        if os.path.exists(ARGS.control_socket):
+            os.remove(ARGS.control_socket)
+        CONTROL_SERVER = event_loop().run_until_complete(
+            asyncio.start_unix_server(serve_control_client, ARGS.control_socket)
+        )
+        os.chmod(ARGS.control_socket, 0o600)
+        CONTROL_SOCKET_INODE = os.stat(ARGS.control_socket).st_ino
+    if ARGS.ready_fd >= 0:  # let the smdv CLI know that the server is ready
+        os.write(ARGS.ready_fd, f"{os.getpid()}\n".encode())
+        os.close(ARGS.ready_fd)
+    try:
+        event_loop().run_forever()
+    finally:
+        close_server()
+
+
+# run server in new subprocess
+def run_server_in_subprocess(
+    args: list = None, listen_fds: list = (), timeout: float = 10.0
+) -> int:
+    """ start the smdv server in a subprocess
+
+    Blocks until the server signals (over an inherited pipe) that it accepts
+    connections, or until it exits.
+
+    Args:
+        args: the command line arguments of the server (see server_args)
+        listen_fds: listening sockets to pass on to the server
+        timeout: the maximum time (in seconds) to wait for the server
+
+    Returns:
+        pid: int: the pid of the server (0 when it exited before being ready)
+    """
+    args_list = list(server_args() if args is None else args)
+    if listen_fds:
+        args_list += ["--listen-fds"] + [str(fd) for fd in listen_fds]
+    read_fd, write_fd = os.pipe()
+    args_list += ["--start-server", "--ready-fd", str(write_fd)]
     with open(os.devnull, "w") as null:
-        subprocess.Popen(["smdv"] + args_list, stdout=null, stderr=null)
+        subprocess.Popen(
+            ["smdv"] + args_list,
+            stdout=null,
+            stderr=null,
+            pass_fds=(write_fd, *listen_fds),
+        )
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as pipe:  # EOF when the server exits early
+        ready = select.select([pipe], [], [], timeout)[0] and pipe.readline()
+    return int(ready or 0)
 
 
-# websocket server
-def run_websocket_server():
-    """ start and run the websocket server """
-    global WEBSOCKETS_SERVER
-    WEBSOCKETS_SERVER = websockets.serve(
-        serve_client, ARGS.websocket_host, ARGS.websocket_port
-    )
-    EVENT_LOOP.run_until_complete(WEBSOCKETS_SERVER)
-    EVENT_LOOP.run_forever()
+# convert a markdown section to html (using the render cache)
+def section2body(section: str, static_url: str) -> tuple:
+    """ convert a markdown section to html, reusing the html of unchanged sections
+
+    Args:
+        section: the markdown section to convert (see split_sections)
+        static_url: the url to prefix relative links with (see md2body)
+
+    Returns:
+        html: str: the resulting html
+        fallback: bool: whether the section is shown as text (see checked_md2body)
+    """
+    key = (hashlib.sha256(section.encode(errors="replace")).hexdigest(), "md", static_url)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached[1], False
+    html, fallback = checked_md2body(section, static_url)
+    if not fallback:  # markdown shown as text is not cached
+        cache_put(key, ("md", html), persist=False)
+    return html, fallback
 
 
 # send a message to the websocket server at the python client
 def send_as_pyclient(message: dict):
     """ send a message to the websocket server as the python client
 
+    The message is sent over the control socket when possible.
+
     Args:
         message: the message to send (in dictionary format)
     """
     try:
-        EVENT_LOOP.run_until_complete(send_as_pyclient_async(message))
+        control_request("push", message=message)
+        return
+    except OSError:
+        pass  # no control socket: connect as websocket client
+    try:
+        event_loop().run_until_complete(send_as_pyclient_async(message))
     except RuntimeError:
         pass  # allows messages to be lost when sending many messages at once.
 
@@ -1568,6 +4732,8 @@ def send_delete_request_to_server():
     Returns:
         exit_status: the exit status (0=success, 1=failure)
     """
+    import http.client
+
     connection = http.client.HTTPConnection(ARGS.host, ARGS.port)
     try:
         connection.connect()
@@ -1584,8 +4750,93 @@ def send_delete_request_to_server():
 
 # update body of smdv from stdin
 def send_message_from_stdin():
-    """ read content from stdin and place it in the html body """
-    content = sys.stdin.read()
+    """ read content from stdin and place it in the html body
+
+    Small input is sent to the server at once (and can be a json message).
+    Larger (or slowly arriving) input is spooled to a temporary file instead,
+    which is followed by the server (see follow), such that the browser shows
+    the input while it is still arriving. Spooling stops when the server
+    stops following the input (e.g. when another file is shown).
+    """
+    chunks, size, deadline = [], 0, time.monotonic() + 0.5
+    while size < STDIN_STREAM_SIZE:
+        if not select.select([0], [], [], max(deadline - time.monotonic(), 0))[0]:
+            break  # stdin is slow: stream it
+        chunk = os.read(0, STDIN_STREAM_SIZE - size)
+        if not chunk:  # end of (small) input
+            send_stdin_message(b"".join(chunks).decode(errors="replace"))
+            return
+        chunks.append(chunk)
+        size += len(chunk)
+
+    cwd = os.path.abspath(os.path.expanduser(os.getcwd()))[len(ARGS.home) :] + "/"
+    fd, path = tempfile.mkstemp(prefix="smdv-stdin-")
+    try:
+        os.write(fd, b"".join(chunks))
+        control_request(
+            "follow",
+            path=path,
+            filename="@pipe",
+            cwd=cwd,
+            encoding=ARGS.stdin,
+            spool=True,
+            max_lines=ARGS.follow_max_lines,
+        )
+    except OSError:  # the server can't follow files: send everything at once
+        os.close(fd)
+        os.remove(path)
+        chunks.append(sys.stdin.buffer.read())
+        send_stdin_message(b"".join(chunks).decode(errors="replace"))
+        return
+    try:
+        splice = getattr(os, "splice", None)  # zero-copy from a pipe (linux)
+        # (the server removes the spool file once it stops following it):
+        while os.fstat(fd).st_nlink:
+            try:
+                if splice is not None and splice(0, fd, STDIN_STREAM_SIZE) == 0:
+                    break
+            except OSError:  # stdin is no pipe
+                splice = None
+            if splice is None:
+                chunk = os.read(0, STDIN_STREAM_SIZE)
+                if not chunk:
+                    break
+                os.write(fd, chunk)
+    finally:
+        os.close(fd)
+        with contextlib.suppress(OSError):  # (the server may be gone)
+            control_request("follow_end", path=path)
+
+
+# send a PUT request to the smdv server
+def send_put_request(content: str) -> int:
+    """ send content to the smdv server with a PUT request (like editor plugins do)
+
+    Args:
+        content: the markdown content to send
+
+    Returns:
+        status: the http status of the response
+    """
+    import http.client
+
+    connection = http.client.HTTPConnection(ARGS.host, ARGS.port)
+    try:
+        connection.request("PUT", "/", body=content.encode())
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+# send content read from stdin to the smdv server
+def send_stdin_message(content: str):
+    """ send content read from stdin (markdown or a json message) to the smdv server
+
+    Args:
+        content: the content read from stdin
+    """
     try:
         message = json.loads(content)
     except json.decoder.JSONDecodeError:
@@ -1595,7 +4846,7 @@ def send_message_from_stdin():
     message["cwd"] = message.get("cwd", cwd)
     message["cwdEncoded"] = bool(message.get("cwdEncoded", True))
     message["cwdBody"] = message.get("cwdBody", dir2body(cwd))
-    message["cwdCwd"] = message.get("fileCwd", cwd)
+    message["fileCwd"] = message.get("fileCwd", cwd)
     message["filename"] = message.get("filename", "@pipe")
     message["fileEncoding"] = message.get("fileEncoding", ARGS.stdin)
     message["fileEncoded"] = bool(message.get("fileEncoded", False))
@@ -1604,6 +4855,45 @@ def send_message_from_stdin():
     send_as_pyclient(message)
 
 
+# get the command line arguments of the smdv server
+def server_args() -> list:
+    """ get the command line arguments to start an smdv server with
+
+    Returns:
+        args: list: the arguments reflecting the current configuration
+    """
+    args = {
+        "--home": ARGS.home,
+        "--stdin": ARGS.stdin,
+        "--port": ARGS.port,
+        "--host": ARGS.host,
+        "--md-css-cdn": ARGS.md_css_cdn,
+        "--nvim-address": ARGS.nvim_address,
+        "--control-socket": ARGS.control_socket,
+        "--render-cache-size": ARGS.render_cache_size,
+        "--markdown-backend": ARGS.markdown_backend,
+        "--render-workers": ARGS.render_workers,
+        "--render-timeout": ARGS.render_timeout,
+        "--render-memory": ARGS.render_memory,
+        "--fast-render-size": ARGS.fast_render_size,
+        "--fast-render-blocks": ARGS.fast_render_blocks,
+        "--prerender-budget": ARGS.prerender_budget,
+        "--disk-cache-size": ARGS.disk_cache_size,
+        "--cache-dir": ARGS.cache_dir,
+    }
+
+    args_list = [str(s) for kv in args.items() for s in kv]  # flattened dict as list
+    if ARGS.interactive:
+        args_list += ["--interactive"]
+    if ARGS.nvim_attach:
+        args_list += ["--nvim-attach"]
+    args_list += ["--size-budget"] + [f"{k}={v:g}" for k, v in ARGS.size_budget.items()]
+    if ARGS.profile:
+        args_list += ["--profile", "--profile-dir", ARGS.profile_dir]
+        args_list += ["--profile-every", str(ARGS.profile_every)]
+    return args_list
+
+
 # check if a socket is in use
 def socket_in_use(address: str) -> bool:
     """ check if a socket is in use
@@ -1616,53 +4906,464 @@ def socket_in_use(address: str) -> bool:
     """
 
     if ":" in address:  # inet socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        host, port = address.split(":")
-        result = sock.connect_ex((host, int(port)))
-        if result == 0:
-            return True
-        else:
-            return False
-        sock.close()
+        host, port = address.rsplit(":", 1)
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            return sock.connect_ex((host, int(port))) == 0
     else:  # unix socket
-        if os.path.exists(address):
-            return True
-        return False
+        return os.path.exists(address)
+
+
+# record a timing span in the chrome trace
+@contextlib.contextmanager
+def span(name: str, sample: bool = False, **args):
+    """ record a timing span in the chrome trace (only when profiling)
+
+    Args:
+        name: the name of the span
+        sample: wether the span is a request which can be sampled with cProfile
+            and tracemalloc (every --profile-every requests).
+        **args: additional arguments shown with the span in the trace. The
+            arguments are yielded as a dictionary, such that they can still be
+            updated inside the block.
+    """
+    global PROFILE_REQUESTS
+    if PROFILE is None:
+        yield args
+        return
+    profiler = None
+    if sample:
+        PROFILE_REQUESTS += 1
+        if ARGS.profile_every and PROFILE_REQUESTS % ARGS.profile_every == 0:
+            import cProfile, tracemalloc
+
+            tracemalloc.start()
+            profiler = cProfile.Profile()
+            profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter()
+        if profiler is not None:
+            profiler.disable()
+            prefix = f"{PROFILE.name[:-5]}-{PROFILE_REQUESTS}"
+            profiler.dump_stats(f"{prefix}.prof")
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, m.__file__) for m in (cProfile, tracemalloc)]
+            )
+            tracemalloc.stop()
+            with open(f"{prefix}.tracemalloc.txt", "w") as file:
+                for stat in snapshot.statistics("lineno")[:50]:
+                    print(stat, file=file)
+            args["sample"] = prefix
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {k: str(v) for k, v in args.items()},
+        }
+        PROFILE.write(json.dumps(event) + ",\n")
+        if sample:
+            PROFILE.flush()
+
+
+# split markdown into chunks that can be rendered in parallel
+def split_chunks(content: str, size: int, abbreviations: bool = True) -> tuple:
+    """ split markdown at top-level block boundaries into chunks of about `size` characters
+
+    Link, abbreviation and footnote definitions are taken out of the chunks.
+
+    Args:
+        content: the markdown to split
+        size: the minimum size of a chunk (except for the last one)
+        abbreviations: whether to take out the abbreviation definitions as
+            well (markdown-it has no abbreviations)
+
+    Returns:
+        chunks: list: the chunks of markdown
+        references: list: the lines defining reference links and abbreviations
+        footnotes: list: the lines defining footnotes (preceded by empty lines)
+    """
+    chunks, chunk, chunk_size, references, footnotes = [], [], 0, [], []
+    fence, depth, footnote, previous = "", 0, False, ""
+    for line in content.split("\n"):
+        match = re.match(r" {0,3}(`{3,}|~{3,})", line)
+        if footnote and line.startswith(("    ", "\t")):
+            footnotes.append(line)  # the continuation of a footnote definition
+            continue
+        if footnote and not line.strip():
+            footnotes.append(line)  # (kept in the chunk as well, in case the definition ended)
+        else:
+            footnote = False
+        if fence:
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                fence = ""
+        elif depth == 0 and re.match(r"\[\^[^\]]+\]:", line):
+            footnote = True
+            footnotes += ["", line]
+            continue
+        elif depth == 0 and re.match(r" {0,3}\[[^\]]+\]:\s*\S", line):
+            references.append(line)
+            continue
+        elif depth == 0 and abbreviations and re.match(r"\*\[[^\]]+\]:", line):
+            references.append(line)
+            continue
+        else:
+            if (
+                chunk_size >= size
+                and depth == 0
+                and not previous.strip()
+                and line
+                and not re.match(r"[\s>:|]|[-*+]\s|\d+[.)]\s", line)
+            ):
+                chunks.append("\n".join(chunk))
+                chunk, chunk_size = [], 0
+            if match:
+                fence = match.group(1)
+            else:  # html blocks end with the closing tag of their first tag
+                depth += len(re.findall(r"<(?:!--|(?:div|table|pre|details|section|p)\b)", line))
+                depth -= len(re.findall(r"-->|</(?:div|table|pre|details|section|p)>", line))
+                depth = max(depth, 0)
+        chunk.append(line)
+        chunk_size += len(line) + 1
+        previous = line
+    chunks.append("\n".join(chunk))
+    return chunks, references, footnotes
+
+
+# split markdown into sections that can be rendered separately
+def split_sections(content: str) -> list:
+    """ split markdown into sections that can be rendered separately
+
+    Args:
+        content: the markdown to split
+
+    Returns:
+        sections: list: the sections, which join (with newlines) to content
+    """
+    if len(content) < SECTION_MIN_SIZE or re.search(
+        r"^ {0,3}\[[^\]]+\]:|^\*\[|\[TOC\]|markdown=", content, re.MULTILINE
+    ):
+        return [content]
+    sections, section, headings, fence, previous = [], [], set(), "", ""
+    for line in content.split("\n"):
+        match = re.match(r" {0,3}(`{3,}|~{3,})", line)
+        if fence:
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                fence = ""
+        elif match:
+            fence = match.group(1)
+        elif re.match(r"#{1,6}(\s|$)", line):
+            heading = line.strip("# \t").lower()
+            if heading in headings:
+                return [content]  # the heading ids depend on the whole document
+            headings.add(heading)
+            if section and not previous.strip():
+                sections.append("\n".join(section))
+                section = []
+        section.append(line)
+        previous = line
+    sections.append("\n".join(section))
+    return sections
+
+
+# start profiling
+def start_profiling(server: str):
+    """ start writing timing spans to a chrome trace file
+
+    Args:
+        server: the name of the server to profile
+    """
+    global PROFILE
+    os.makedirs(ARGS.profile_dir, exist_ok=True)
+    filename = os.path.join(ARGS.profile_dir, f"smdv-{server}-{os.getpid()}.json")
+    PROFILE = open(filename, "w")
+    PROFILE.write("[\n")
+    metadata = {"name": "process_name", "ph": "M", "pid": os.getpid()}
+    PROFILE.write(json.dumps({**metadata, "args": {"name": f"smdv {server}"}}) + ",\n")
+    PROFILE.flush()
+    atexit.register(stop_profiling)
+
+
+# serve a static file
+def static_file(path: str, headers: dict) -> tuple:
+    """ serve a file from the smdv home as is
+
+    Args:
+        path: the path of the file (relative to the smdv home)
+        headers: the request headers (with lowercase names)
+
+    Returns:
+        response: tuple: the status, the response headers and the file contents
+    """
+    import mimetypes, email.utils
+
+    try:
+        filename = home_path(path)
+    except FileNotFoundError:
+        return 404, {}, b"not found.\n"
+    if not os.path.isfile(filename):
+        return 404, {}, b"not found.\n"
+    last_modified = email.utils.formatdate(os.stat(filename).st_mtime, usegmt=True)
+    response_headers = {"Last-Modified": last_modified, "Cache-Control": "no-cache"}
+    if headers.get("if-modified-since") == last_modified:
+        return 304, response_headers, b""
+    mimetype, encoding = mimetypes.guess_type(filename)
+    mimetype = mimetype or "application/octet-stream"
+    if mimetype.startswith("text/"):
+        mimetype += "; charset=utf-8"
+    response_headers["Content-Type"] = mimetype
+    if encoding:
+        response_headers["Content-Encoding"] = encoding
+    with open(filename, "rb") as file:
+        return 200, response_headers, file.read()
+
+
+# stop profiling
+def stop_profiling():
+    """ close the chrome trace file (if open) """
+    global PROFILE
+    if PROFILE is None:
+        return
+    PROFILE.write(json.dumps({"name": "trace_end", "ph": "i", "s": "g", "pid": os.getpid(),
+                              "ts": time.perf_counter() * 1e6}) + "\n]\n")
+    PROFILE.close()
+    PROFILE = None
+
+
+# stop the smdv server
+def stop_server() -> int:
+    """ stop the smdv server
+
+    The server is asked to shut down over the control socket. Only when the
+    control socket is not reachable, a DELETE request is sent instead.
+
+    Returns:
+        exit_status: the exit status of the shutdown (0: success)
+    """
+    try:
+        control_request("shutdown")
+        return 0
+    except OSError:
+        return send_delete_request_to_server()
+
+
+# get a (cached) table
+def table(path: str) -> Table:
+    """ get the table of a csv or tsv file (which is indexed only once)
+
+    Args:
+        path: the (absolute) path of the csv or tsv file
+
+    Returns:
+        table: Table: the table, cached as long as the file doesn't change
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if key in TABLES:
+        TABLES.move_to_end(key)
+        return TABLES[key]
+    delimiter = TABLE_EXTENSIONS[os.path.splitext(path)[1].lower()]
+    TABLES[key] = Table(path, delimiter)
+    while len(TABLES) > TABLES_MAX:
+        TABLES.popitem(last=False)[1].close()
+    return TABLES[key]
+
+
+# convert a csv or tsv file to html
+def table2body(path: str) -> str:
+    """ convert a csv or tsv file to an html table with its first TABLE_WINDOW rows
+
+    The other rows are requested by the js client when needed (see the rows
+    func in handle_message), as are sorted and filtered windows.
+
+    Args:
+        path: the (absolute) path of the csv or tsv file
+
+    Returns:
+        html: str: the html table
+    """
+    import html
+
+    with timed("table2body"):
+        body, done = table_window(path, 0)
+        header = "".join(
+            f'<th data-column="{i}">{html.escape(field)}</th>'
+            for i, field in enumerate(table(path).header)
+        )
+        return (
+            '<input class="smdv-table-query" type="search" placeholder="filter rows">'
+            f'<table class="smdv-table" data-done="{str(done).lower()}">'
+            f"<thead><tr>{header}</tr></thead><tbody>{body}</tbody></table>"
+        )
+
+
+# get a window of rows of a table as html
+def table_window(
+    path: str, start: int, sort: int = None, descending: bool = False, query: str = ""
+) -> tuple:
+    """ get a window of TABLE_WINDOW rows of a csv or tsv file as html table rows
+
+    Args:
+        path: the (absolute) path of the csv or tsv file
+        start: the first row of the window
+        sort: the column to sort by (None to keep the file order)
+        descending: whether to sort in descending order
+        query: only keep the rows containing query (case insensitive)
+
+    Returns:
+        html: str: the table rows
+        done: bool: whether the window contains the last row
+    """
+    import html
+
+    rows, done = table(path).window(
+        start, TABLE_WINDOW, None if sort is None else int(sort), descending, query
+    )
+    body = "".join(
+        "<tr>" + "".join(f"<td>{html.escape(field)}</td>" for field in row) + "</tr>"
+        for row in rows
+    )
+    return body, done
+
+
+# time a block of code
+@contextlib.contextmanager
+def timed(function: str, **labels):
+    """ time a block of code and record its duration as render duration metric
+
+    Args:
+        function: the name of the timed function (added as label)
+        **labels: additional labels for the metric. The labels are yielded as a
+            dictionary, such that they can still be updated inside the block.
+    """
+    labels["function"] = function
+    start = time.perf_counter()
+    with span(function, **labels) as labels:
+        try:
+            yield labels
+        finally:
+            duration = time.perf_counter() - start
+            observe_metric("smdv_render_duration_seconds", duration, **labels)
+
+
+# time the processor of a markdown extension
+def timed_extension(method, extension: str, tier: str):
+    """ wrap a method of a markdown extension processor to record the time spent in it
+
+    Args:
+        method: the (bound) method to wrap
+        extension: the name of the extension the processor belongs to
+        tier: the render tier of the interpreter (see markdown_interpreter)
+
+    Returns:
+        wrapper: the method adding its duration to smdv_extension_duration_seconds_total
+    """
+    labels = (("extension", extension), ("tier", tier))
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            COUNTERS["smdv_extension_duration_seconds_total", labels] += (
+                time.perf_counter() - start
+            )
+
+    return wrapper
+
+
+# create the table of contents of headings
+def toc2body(headings: list) -> str:
+    """ create the html of a table of contents like the toc extension of python-markdown
+
+    Args:
+        headings: the (level, id, title) of every heading, where the title
+            is plain text
+
+    Returns:
+        html: str: the nested lists of links to the headings
+    """
+    import html
+    from markdown.extensions.toc import nest_toc_tokens
+
+    def items(tokens: list) -> str:
+        lines = ["<ul>"]
+        for token in tokens:
+            children = items(token["children"]) if token["children"] else ""
+            lines.append(f'<li><a href="#{token["id"]}">{html.escape(token["name"])}</a>{children}</li>')
+        return "\n".join(lines + ["</ul>"])
+
+    tokens = nest_toc_tokens(
+        [{"level": level, "id": anchor, "name": title} for level, anchor, title in headings]
+    )
+    return f'<div class="toc">\n{items(tokens)}\n</div>'
+
+
+# track a task handling a request
+def track(coroutine) -> "asyncio.Task":
+    """ schedule a coroutine handling a request as a task that is drained on shutdown
+
+    Args:
+        coroutine: the coroutine handling the request
+
+    Returns:
+        task: asyncio.Task: the scheduled task
+    """
+    import asyncio
+
+    task = asyncio.ensure_future(coroutine)
+    INFLIGHT.add(task)
+    task.add_done_callback(INFLIGHT.discard)
+    return task
 
 
 # convert text file to html
-def txt2body(content: str) -> str:
+def txt2body(content: str, static_url: str = None) -> str:
     """ Convert text content to html
 
     Args:
         content: the content to encode as html
+        static_url: the url to prefix relative links with (see md2body)
     """
-    content = f"```\n{content}\n```"
-    return md2body(content)
+    with timed("txt2body"):
+        content = f"```\n{content}\n```"
+        return md2body(content, static_url)
 
 
 # send message to smdv to load filename
 def update_filename():
-    """ open filename in smdv """
-    path = os.path.abspath(os.path.expanduser(ARGS.filename))
+    """ open filename in smdv (and follow it with --follow) """
+    fullpath = os.path.abspath(os.path.expanduser(ARGS.filename))
+    path = fullpath
     if path.startswith(ARGS.home):
         path = path[len(ARGS.home) :]
-    cwd, filename = change_current_working_directory(path)
-    with open(filename, "r") as file:
-        content = file.read()
-    message = {
-        "func": "file",
-        "cwd": cwd,
-        "cwdBody": dir2body(cwd),
-        "cwdEncoded": True,
-        "filename": filename,
-        "fileBody": content,
-        "fileCwd": cwd,
-        "fileOpen": True,
-        "fileEncoding": "",
-        "fileEncoded": False,
-        "NvimAddress": ARGS.nvim_address,
-    }
+    if ARGS.follow:
+        encoding = file_type(fullpath)
+        try:
+            control_request(
+                "follow",
+                path=fullpath,
+                filename=os.path.basename(path),
+                cwd=os.path.dirname(path).rstrip("/") + "/",
+                encoding=encoding,
+                tail=True,
+                max_lines=ARGS.follow_max_lines,
+            )
+            return
+        except OSError:
+            warnings.warn("the smdv server can't be reached to follow the file")
+    try:  # let the websocket server read the file
+        control_request("open", path=path, nvimAddress=ARGS.nvim_address)
+        return
+    except OSError:
+        pass  # no control socket: read the file here
+    message = file_message(path)
+    message["NvimAddress"] = ARGS.nvim_address
     send_as_pyclient(message)
 
 
@@ -1685,12 +5386,18 @@ def validate_message(message: str):
         for key in keys:
             assert key in message, f"message {message} has no key '{key}'"
             assert key in keys, f"{key} is not a valid message key"
+    for key in ("cwd", "fileCwd"):
+        if key in message:
+            home_path(message[key])  # raises for directories outside of the smdv home
 
 
 # wait until at least on js client is online.
 def wait_for_connected_jsclient(interval: float = 0.3, max_attempts: int = 6):
     """ wait until a connection to the browser can be made.
 
+    The smdv server notifies the CLI over the control socket as soon as a
+    browser connects. Only without control socket, the server is polled.
+
     Args:
         interval: the interval time to check for the websocket server connection
         max_attempts: the maximum number of tries before exiting with failure
@@ -1698,6 +5405,13 @@ def wait_for_connected_jsclient(interval: float = 0.3, max_attempts: int = 6):
     Returns:
         exit_status: the exit status after waiting
     """
+    try:
+        control_request("wait_jsclient", timeout=interval * max_attempts)
+        return
+    except RuntimeError:
+        raise ConnectionRefusedError("could not establish a connection with a browser")
+    except OSError:
+        pass  # no control socket: poll
     for _ in range(max_attempts):  # max 10 tries, throw error otherwise
         if number_of_connected_jsclients() > 0:
             return
@@ -1705,19 +5419,17 @@ def wait_for_connected_jsclient(interval: float = 0.3, max_attempts: int = 6):
     raise ConnectionRefusedError("could not establish a connection with a browser")
 
 
-# block until a connection to the websocket server can be established
+# block until the smdv server is running (or stopped)
 def wait_for_server(
     interval: float = 0.3,
     max_attempts: int = 10,
-    server: str = "flask",
     status: str = "running",
 ):
-    """ wait until a connection to one of the servers can be established
+    """ wait until the smdv server is running (or stopped)
 
     Args:
         interval: the interval time to check for the websocket server connection
         max_attempts: the maximum number of tries before exiting with failure
-        server: the server to ask the status for ["flask", "websocket"]
         status: wait for ["running", "stopped"] status.
 
     Returns:
@@ -1726,11 +5438,11 @@ def wait_for_server(
     if status not in ["running", "stopped"]:
         raise ValueError("wait for server expects status 'running' or 'stopped'")
     for _ in range(max_attempts):  # max 10 tries, throw error otherwise
-        if request_server_status(server=server) == "running":
+        if request_server_status() == status:
             return
         time.sleep(interval)
     raise ConnectionRefusedError(
-        f"connection to {server} server could not be established"
+        f"smdv server is not {status}"
     )
 
 